@@ -1,9 +1,10 @@
-import pycountry
-
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import Count, F
 from django.contrib.auth.models import User
 from .models import Destination, DreamDestinationsList
-from .models import Country, CountryList
+from .models import Country, CountryList, CountryVisits
+from . import countries
 
 class DestinationAdmin(admin.ModelAdmin):
     model = Destination
@@ -37,20 +38,33 @@ class CountryAdmin(admin.ModelAdmin):
 
     @staticmethod
     def populate_database(user):
-        for country in pycountry.countries:
-            if country.name == 'United States':
-                cities_count = 250
-            else:
-                cities_count = 30
-            object = Country(name = country.name, cities_to_visit = cities_count, visited = False, 
-                             countries_list = CountryList.objects.filter(owner = user).get())
-            object.save()
+        # New users get their rows lazily, when they touch a country. This creates the rows
+        # of all countries at once for the users which need them.
+        countries_list = CountryList.objects.filter(owner = user).get()
+        objects = []
+        for country in countries.get_catalogue().values():
+            objects.append(Country(name = country.name, cities_to_visit = country.cities_to_visit,
+                                   visited = False, countries_list = countries_list))
+        Country.objects.bulk_create(objects)
+
+    @staticmethod
+    def touch_country(user, code):
+        """Return the row of the user for a country code, creating it on the first touch."""
+        entry = countries.get_catalogue_country(code)
+        countries_list = CountryList.objects.filter(owner = user).get()
+        country, created = Country.objects.get_or_create(
+            name = entry.name, countries_list = countries_list,
+            defaults = {'cities_to_visit': entry.cities_to_visit, 'visited': False})
+        return country
             
     @staticmethod
     def find_most_visited_country():
-        most_visited_dict={}
-        for country in pycountry.countries:
-            most_visited_dict[country.name] = Country.objects.filter(name = country.name, visited = True).count() 
+        # The visits are read from the maintained counters, not from the rows of every user.
+        visits = dict(CountryVisits.objects.filter(visits__gt = 0).values_list('name', 'visits'))
+        # Iterate in the pycountry order, so the ties are broken the same way as before.
+        most_visited_dict = {}
+        for country in countries.get_catalogue().values():
+            most_visited_dict[country.name] = visits.get(country.name, 0)
         return max(most_visited_dict, key = most_visited_dict.get)
         
 class CountriesListAdmin(admin.ModelAdmin):
@@ -68,3 +82,58 @@ class CountriesListAdmin(admin.ModelAdmin):
 admin.site.register(Country, CountryAdmin)
 admin.site.register(CountryList, CountriesListAdmin)
 
+
+
+class CountryVisitsAdmin(admin.ModelAdmin):
+    model = CountryVisits
+    ordering = ('-visits', 'name')
+    search_fields = ('name',)
+    list_display = ('name', 'visits')
+    fields = ('name', 'visits')
+
+    @staticmethod
+    def record_visit(name, visited):
+        """Add or remove one visit from the counter of a country."""
+        change = 1 if visited else -1
+        with transaction.atomic():
+            CountryVisits.objects.get_or_create(name = name)
+            CountryVisits.objects.filter(name = name).update(visits = F('visits') + change)
+
+    @staticmethod
+    def country_saving(sender, instance, **kwargs):
+        """Receiver of pre_save of Country. Remember under which name the row is counted before the save."""
+        instance._counted_name = None
+        if instance.pk is not None:
+            instance._counted_name = (Country.objects.filter(pk = instance.pk, visited = True)
+                                      .values_list('name', flat = True).first())
+
+    @staticmethod
+    def country_saved(sender, instance, **kwargs):
+        """Receiver of post_save of Country, e.g. of an edit in the admin site. visit_item_view
+        changes the rows by update(), which sends no signals, and records its visits itself."""
+        previous = getattr(instance, '_counted_name', None)
+        current = instance.name if instance.visited else None
+        if previous != current:
+            if previous is not None:
+                CountryVisitsAdmin.record_visit(previous, False)
+            if current is not None:
+                CountryVisitsAdmin.record_visit(current, True)
+
+    @staticmethod
+    def country_deleted(sender, instance, **kwargs):
+        """Receiver of post_delete of Country, also of the rows deleted together with their user."""
+        if instance.visited:
+            CountryVisitsAdmin.record_visit(instance.name, False)
+
+    @staticmethod
+    def rebuild():
+        """Recount the visits of every country from the rows of all users."""
+        visits = (Country.objects.filter(visited = True)
+                  .values_list('name')
+                  .annotate(visits = Count('id')))
+        with transaction.atomic():
+            CountryVisits.objects.all().delete()
+            CountryVisits.objects.bulk_create([CountryVisits(name = name, visits = count)
+                                               for name, count in visits])
+
+admin.site.register(CountryVisits, CountryVisitsAdmin)
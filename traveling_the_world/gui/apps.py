@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class GuiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gui'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save, pre_save
+        from . import admin
+        from . import metrics
+        from .models import Country
+
+        # Count the SQL queries of every request, on all of the database connections.
+        connection_created.connect(metrics.install_sql_wrapper, dispatch_uid='gui.metrics')
+        # The visit counters follow the rows which are edited or deleted outside of visit_item_view.
+        pre_save.connect(admin.CountryVisitsAdmin.country_saving, sender=Country, dispatch_uid='gui.visits')
+        post_save.connect(admin.CountryVisitsAdmin.country_saved, sender=Country, dispatch_uid='gui.visits')
+        post_delete.connect(admin.CountryVisitsAdmin.country_deleted, sender=Country, dispatch_uid='gui.visits')
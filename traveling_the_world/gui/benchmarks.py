@@ -0,0 +1,340 @@
+"""Benchmarks of the slow paths of the gui app. They are run with `python manage.py benchmark`.
+
+The calls to Google Maps are answered by the local Places stand-in, so the
+results don't depend on the network. The stand-in has no quota, so the
+calls to it aren't rate limited. The data created by a benchmark is
+deleted, or rolled back, after it."""
+import asyncio
+import time
+import uuid
+import statistics
+import pycountry
+import countryinfo
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import AsyncClient, Client, override_settings
+
+from . import admin
+from . import models
+from . import places
+from . import fake_places
+
+BENCHMARK_USERNAME = 'benchmark_user'
+# The load test sends this many requests for a background photo, while the
+# Places stand-in answers every call after this many seconds.
+LOAD_TEST_REQUESTS = 20
+LOAD_TEST_PLACES_DELAY = 0.1
+# The number of users for which find_most_visited_country is measured.
+MOST_VISITED_USERS = (10, 1000, 100000)
+MOST_VISITED_BATCH_SIZE = 5000
+# Every request of the benchmarks reaches the Places stand-in, nothing is cached.
+NO_PLACES_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'places': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+# The answers of the Places stand-in are cached only in the memory of the benchmark,
+# so the real pages never serve them.
+LOCAL_PLACES_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'places': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark-places'},
+}
+
+
+def measure(function, repeat, setup=None, teardown=None):
+    """Call function repeat times and return its timings in milliseconds.
+    The value returned by setup is passed to function and teardown, and
+    only the call of function itself is measured."""
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        if setup is not None:
+            function(argument)
+        else:
+            function()
+        timings.append((time.perf_counter() - start) * 1000)
+        if teardown is not None:
+            teardown(argument)
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def _create_user():
+    # A throwaway name, so an existing user is never deleted by a benchmark.
+    return User.objects.create_user(username=f'{BENCHMARK_USERNAME}_{uuid.uuid4().hex}')
+
+
+def _delete_user(user):
+    user.delete()
+
+
+def _legacy_onboarding(user):
+    """The onboarding before the bulk inserts: one INSERT and one
+    CountryList query per country, each in its own transaction."""
+    admin.CountriesListAdmin.populate_database(user)
+    for country in pycountry.countries:
+        if country.name == 'United States':
+            cities_count = 250
+        else:
+            cities_count = 30
+        object = models.Country(name=country.name, cities_to_visit=cities_count, visited=False,
+                                countries_list=models.CountryList.objects.filter(owner=user).get())
+        object.save()
+    admin.DreamDestinationsListAdmin.populate_database(user)
+
+
+def _bulk_onboarding(user):
+    """The onboarding with the rows of all countries created by one bulk insert."""
+    with transaction.atomic():
+        admin.CountriesListAdmin.populate_database(user)
+        admin.CountryAdmin.populate_database(user)
+        admin.DreamDestinationsListAdmin.populate_database(user)
+
+
+def _onboarding(user):
+    """The onboarding done by views.register. The countries get their rows lazily."""
+    with transaction.atomic():
+        admin.CountriesListAdmin.populate_database(user)
+        admin.DreamDestinationsListAdmin.populate_database(user)
+
+
+def benchmark_signup(repeat):
+    """Latency of populating the database for a new user, before and after the bulk inserts."""
+    return {
+        'legacy': measure(_legacy_onboarding, repeat, _create_user, _delete_user),
+        'bulk': measure(_bulk_onboarding, repeat, _create_user, _delete_user),
+        'current': measure(_onboarding, repeat, _create_user, _delete_user),
+    }
+
+
+def _legacy_biggest_cities(utilities, country_name):
+    """find_biggest_cities_by_country_name before the city index: a scan of all cities per call."""
+    country_code = countryinfo.CountryInfo(country_name).iso()['alpha2']
+    list_of_cities = []
+    for city in utilities.geonames.get_cities().values():
+        if city['countrycode'] == country_code:
+            list_of_cities.append(city)
+    if country_code == 'US':
+        usa_cities = []
+        for state in utilities.geonames.get_us_states().keys():
+            curr_state_list = [city for city in list_of_cities if city['admin1code'] == state]
+            curr_state_list.sort(reverse=True,key=lambda item: item.get('population'))
+            usa_cities.extend(curr_state_list[0:5])
+        usa_cities.sort(reverse=True,key=lambda item: item.get('population'))
+        return [city['name'] for city in usa_cities]
+    list_of_cities.sort(reverse=True,key=lambda item: item.get('population'))
+    return [city['name'] for city in list_of_cities[0:30]]
+
+
+def _known_country_names():
+    """The pycountry names which countryinfo can resolve to a country code."""
+    names = []
+    for country in pycountry.countries:
+        try:
+            countryinfo.CountryInfo(country.name).iso()
+        except LookupError:
+            continue
+        names.append(country.name)
+    return names
+
+
+def benchmark_biggest_cities(repeat):
+    """Latency of find_biggest_cities_by_country_name for every country, with and without the index."""
+    utilities = places.PlacesUtilities()
+    names = _known_country_names()
+    legacy_results = {}
+    current_results = {}
+
+    def legacy():
+        for name in names:
+            legacy_results[name] = _legacy_biggest_cities(utilities, name)
+
+    def current():
+        for name in names:
+            current_results[name] = utilities.find_biggest_cities_by_country_name(name)
+
+    timings = {
+        'legacy': measure(legacy, repeat),
+        'current': measure(current, repeat),
+    }
+    timings['countries'] = len(names)
+    timings['mismatches'] = [name for name in names if legacy_results[name] != current_results[name]]
+    return timings
+
+
+def benchmark_async_views(repeat):
+    """Throughput of the background photo endpoint for unresolved destinations when the requests are
+    served one after another, like by a sync worker, and when they are served concurrently by one event loop."""
+    server = fake_places.FakePlacesServer(delay=LOAD_TEST_PLACES_DELAY).start()
+    user = _create_user()
+    try:
+        destination_list = models.DreamDestinationsList.objects.create(owner=user)
+        destinations = models.Destination.objects.bulk_create(
+            models.Destination(destination_name='Amsterdam', country='Netherlands', list_name=destination_list)
+            for _ in range(LOAD_TEST_REQUESTS))
+        urls = [f'/photo/?destination={destination.pk}' for destination in destinations]
+
+        def forget_places():
+            # Every request finds its destination unresolved, so it waits for the Places stand-in.
+            models.Destination.objects.filter(list_name=destination_list).update(place_fetched_at=None)
+
+        with override_settings(PLACES_API_BASE_URL=server.url, CACHES=NO_PLACES_CACHE, PLACES_RATE_LIMITS={},
+                               ALLOWED_HOSTS=['testserver']):
+            client = Client()
+            client.force_login(user)
+            async_client = AsyncClient()
+            async_client.force_login(user)
+
+            def sequential(argument):
+                for url in urls:
+                    client.get(url)
+
+            async def concurrent_requests():
+                await asyncio.gather(*[async_client.get(url) for url in urls])
+
+            def concurrent(argument):
+                asyncio.run(concurrent_requests())
+
+            timings = {'requests': LOAD_TEST_REQUESTS, 'places_delay_ms': LOAD_TEST_PLACES_DELAY * 1000,
+                       'sequential': measure(sequential, repeat, setup=forget_places),
+                       'concurrent': measure(concurrent, repeat, setup=forget_places)}
+    finally:
+        _delete_user(user)
+        server.stop()
+    for mode in ('sequential', 'concurrent'):
+        timings[mode]['requests_per_second'] = round(LOAD_TEST_REQUESTS * 1000 / timings[mode]['median_ms'], 1)
+    return timings
+
+
+def _measure_request(client, method, path, repeat, data=None, setup=None, teardown=None):
+    """Measure a request of the client and count its SQL queries and outbound calls. The path
+    and the data can be functions of the value returned by setup."""
+    def send(argument=None):
+        request_path = path(argument) if callable(path) else path
+        request_data = data(argument) if callable(data) else data
+        response = getattr(client, method)(request_path, request_data)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method.upper()} {request_path} answered {response.status_code}.")
+        return response
+
+    # The first request warms up the caches. Its queries are counted by the metrics middleware.
+    argument = setup() if setup is not None else None
+    with override_settings(DEBUG=True):
+        response = send(argument)
+    if teardown is not None:
+        teardown(argument)
+    timings = measure(send, repeat, setup, teardown)
+    timings['queries'] = int(response['X-SQL-Queries'])
+    timings['outbound_calls'] = int(response['X-Outbound-Calls'])
+    return timings
+
+
+def benchmark_views(repeat):
+    """Latency and SQL queries of every page and action of a user, against the Places stand-in."""
+    server = fake_places.FakePlacesServer().start()
+    password = 'benchmark-password-1234'
+    try:
+        # Everything is rolled back, so the real rows, e.g. the visit counters, are left as they were.
+        with transaction.atomic():
+            user = _create_user()
+            user.set_password(password)
+            user.save()
+            admin.CountriesListAdmin.populate_database(user)
+            admin.DreamDestinationsListAdmin.populate_database(user)
+            destination_list = models.DreamDestinationsList.objects.get(owner=user)
+            destination = models.Destination.objects.create(destination_name='Amsterdam', country='Netherlands',
+                                                            list_name=destination_list)
+            with override_settings(PLACES_API_BASE_URL=server.url, CACHES=LOCAL_PLACES_CACHE, PLACES_RATE_LIMITS={},
+                                   ALLOWED_HOSTS=['testserver']):
+                client = Client()
+                client.force_login(user)
+                new_user = {'username': f'{user.username}_new', 'first_name': 'Benchmark', 'last_name': 'User',
+                            'password1': password, 'password2': password}
+                states = iter(range(10 ** 9))
+
+                def create_destination():
+                    return models.Destination.objects.create(destination_name='Amsterdam', country='Netherlands',
+                                                             list_name=destination_list).pk
+
+                def delete_new_user(argument):
+                    deleted, _ = User.objects.filter(username=new_user['username']).delete()
+                    if not deleted:
+                        raise RuntimeError("The registration of the benchmark user failed.")
+
+                def delete_added_destinations(argument):
+                    destination_list.items.exclude(pk=destination.pk).delete()
+
+                timings = {
+                    'register': _measure_request(Client(), 'post', '/register/', repeat, new_user,
+                                                 teardown=delete_new_user),
+                    'destination': _measure_request(client, 'get', '/destination/', repeat),
+                    'dream_destinations': _measure_request(client, 'get', '/dream_destinations/', repeat),
+                    'details': _measure_request(client, 'get', f'/dream_destinations/details/?id={destination.pk}',
+                                                repeat),
+                    'photo': _measure_request(client, 'get', f'/photo/?destination={destination.pk}', repeat),
+                    'add_item': _measure_request(client, 'post', '/dream_destinations/add_item/', repeat,
+                                                 {'destination_name': 'Amsterdam', 'country': 'Netherlands'},
+                                                 teardown=delete_added_destinations),
+                    'remove_item': _measure_request(client, 'get', lambda pk: f'/remove_item/?id={pk}', repeat,
+                                                    setup=create_destination),
+                    # Every request changes the visited state of the country.
+                    'visit_item': _measure_request(client, 'get', '/visit_item/', repeat,
+                                                   lambda state: {'code': 'NL', 'state': state % 2},
+                                                   setup=lambda: next(states) + 1),
+                }
+            transaction.set_rollback(True)
+    finally:
+        server.stop()
+    return timings
+
+
+def _legacy_most_visited_country():
+    """find_most_visited_country before the visit counters: one COUNT query per country."""
+    most_visited_dict = {}
+    for country in pycountry.countries:
+        most_visited_dict[country.name] = models.Country.objects.filter(name=country.name, visited=True).count()
+    return max(most_visited_dict, key=most_visited_dict.get)
+
+
+def _create_visitors(count):
+    """Create count users, each of whom has visited one country."""
+    names = [country.name for country in pycountry.countries]
+    for start in range(0, count, MOST_VISITED_BATCH_SIZE):
+        stop = min(start + MOST_VISITED_BATCH_SIZE, count)
+        users = User.objects.bulk_create([User(username=f'{BENCHMARK_USERNAME}_{index}', password='!')
+                                          for index in range(start, stop)])
+        lists = models.CountryList.objects.bulk_create([models.CountryList(owner=user) for user in users])
+        models.Country.objects.bulk_create([
+            models.Country(name=names[(start + index) * 7 % len(names)], cities_to_visit=30, visited=True,
+                           countries_list=countries_list)
+            for index, countries_list in enumerate(lists)])
+    admin.CountryVisitsAdmin.rebuild()
+
+
+def benchmark_most_visited(repeat):
+    """Latency of find_most_visited_country for a growing number of users, with and without the counters."""
+    timings = {}
+    for count in MOST_VISITED_USERS:
+        with transaction.atomic():
+            _create_visitors(count)
+            timings[count] = {
+                'legacy': measure(_legacy_most_visited_country, repeat),
+                'current': measure(admin.CountryAdmin.find_most_visited_country, repeat),
+            }
+            # Nothing of the generated users is kept.
+            transaction.set_rollback(True)
+    return timings
+
+
+BENCHMARKS = {
+    'signup': benchmark_signup,
+    'biggest_cities': benchmark_biggest_cities,
+    'async_views': benchmark_async_views,
+    'views': benchmark_views,
+    'most_visited': benchmark_most_visited,
+}
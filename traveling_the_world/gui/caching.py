@@ -0,0 +1,44 @@
+"""Time-based cache of the responses of the external services.
+
+The cache is backed by Django's cache framework. Its backend and eviction are
+configured by settings.CACHES[settings.PLACES_CACHE_ALIAS] and the time to live
+of every kind of response by settings.PLACES_CACHE_TTL."""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULT_TTL = 60 * 60
+
+
+def get_cache():
+    return caches[settings.PLACES_CACHE_ALIAS]
+
+
+def get_ttl(kind):
+    return settings.PLACES_CACHE_TTL.get(kind, DEFAULT_TTL)
+
+
+def make_key(kind, *parts):
+    """Build a key which is safe for every cache backend out of arbitrary strings."""
+    digest = hashlib.sha256(repr(tuple(str(part) for part in parts)).encode()).hexdigest()
+    return f'{kind}:{digest}'
+
+
+def get_or_set(kind, parts, compute, should_cache=None):
+    """Return the cached value for kind and parts. On a miss compute it and cache it,
+    unless should_cache returns False for it (e.g. for error responses)."""
+    cache = get_cache()
+    key = make_key(kind, *parts)
+    value = cache.get(key)
+    if value is not None:
+        return value
+    value = compute()
+    if value is not None and (should_cache is None or should_cache(value)):
+        cache.set(key, value, get_ttl(kind))
+    return value
+
+
+def delete(kind, parts):
+    """Forget the cached value for kind and parts, so the next get_or_set computes it again."""
+    get_cache().delete(make_key(kind, *parts))
@@ -0,0 +1,145 @@
+"""Catalogue of the countries in the world, shared by all of the users.
+
+A user has gui.models.Country rows only for the countries the user has touched.
+Every other country comes from this catalogue, which is built once per process.
+The facts about a country (capital, currencies...) are kept in a bounded in-process store.
+Both are read from the generated country table, see country_table.py."""
+import collections
+import functools
+import json
+import threading
+
+from . import country_table
+
+FACTS_CACHE_SIZE = 512
+
+CountryFacts = collections.namedtuple('CountryFacts', [
+    'name', 'region', 'subregion', 'capital', 'currencies', 'languages',
+    'population', 'wiki', 'alpha2', 'alpha3',
+])
+
+# The columns of the country table with the names of a country, and with its codes.
+NAME_COLUMNS = ('name', 'official_name', 'common_name', 'info_name')
+CODE_COLUMNS = ('alpha2', 'alpha3', 'numeric')
+
+_catalogue = None
+_name_index = None
+_names_only_index = None
+_catalogue_lock = threading.Lock()
+
+
+class CatalogueCountry:
+    """A country which the user has not touched yet. It has the attributes of
+    a gui.models.Country row, but it is identified only by its country code."""
+
+    def __init__(self, name, code, cities_to_visit):
+        self.pk = None
+        self.name = name
+        self.code = code
+        self.cities_to_visit = cities_to_visit
+        self.visited = False
+
+    def __str__(self):
+        return f"{self.name}"
+
+
+def default_cities_to_visit(country_name):
+    if country_name == 'United States':
+        return 250
+    return 30
+
+
+def get_catalogue():
+    """Return the countries of pycountry keyed by their alpha_2 code, in the pycountry order."""
+    global _catalogue
+    if _catalogue is None:
+        with _catalogue_lock:
+            if _catalogue is None:
+                rows = country_table.query("SELECT alpha2, name, cities_to_visit FROM countries "
+                                           "ORDER BY position")
+                _catalogue = {row['alpha2']: CatalogueCountry(row['name'], row['alpha2'], row['cities_to_visit'])
+                              for row in rows}
+    return _catalogue
+
+
+def get_catalogue_country(code):
+    """Return the catalogue entry of a country code. Raises KeyError for unknown codes."""
+    return get_catalogue()[code.upper()]
+
+
+def get_name_index(names_only=False):
+    """Return the alpha_2 codes of the countries keyed by every case-folded name and code of them,
+    or only by their names."""
+    global _name_index, _names_only_index
+    if _name_index is None:
+        with _catalogue_lock:
+            if _name_index is None:
+                name_index = {}
+                names_only_index = {}
+                columns = NAME_COLUMNS + CODE_COLUMNS
+                rows = country_table.query(f"SELECT {', '.join(columns)} FROM countries ORDER BY position")
+                for row in rows:
+                    for column in columns:
+                        if row[column]:
+                            # The first country with a name keeps it, like pycountry's lookup.
+                            name_index.setdefault(row[column].casefold(), row['alpha2'])
+                            if column in NAME_COLUMNS:
+                                names_only_index.setdefault(row[column].casefold(), row['alpha2'])
+                _names_only_index = names_only_index
+                _name_index = name_index
+    return _names_only_index if names_only else _name_index
+
+
+def find_country_code(country_name, names_only=False):
+    """Return the alpha_2 code of a country by any of its names or codes, or None if it is unknown.
+    With names_only, codes such as 'BGR' or '100' are unknown."""
+    return get_name_index(names_only).get(str(country_name).strip().casefold())
+
+
+def normalize_country_name(country_name):
+    """Return the canonical (pycountry) name of a country, or None if it is unknown."""
+    code = find_country_code(country_name)
+    if code is None:
+        return None
+    return get_catalogue()[code].name
+
+
+def merge_with_catalogue(rows):
+    """Return every country in the world, where the countries touched by the user
+    are the user's own rows and the rest are entries of the shared catalogue."""
+    rows_by_name = {row.name: row for row in rows}
+    items = []
+    for entry in get_catalogue().values():
+        row = rows_by_name.pop(entry.name, None)
+        if row is None:
+            items.append(entry)
+        else:
+            row.code = entry.code
+            items.append(row)
+    # Rows with names which are not in the catalogue are kept at the end.
+    for row in rows_by_name.values():
+        row.code = None
+        items.append(row)
+    return items
+
+
+@functools.lru_cache(maxsize=FACTS_CACHE_SIZE)
+def get_country_facts(country_name):
+    """Return the facts about a country, reading its record from the country table only once.
+    Raises LookupError for unknown countries and for countries without countryinfo data."""
+    code = find_country_code(country_name)
+    rows = country_table.query("SELECT * FROM countries WHERE alpha2 = ?", (code,)) if code else []
+    if not rows or rows[0]['info_name'] is None:
+        raise LookupError(f"Unknown country: {country_name}")
+    row = rows[0]
+    return CountryFacts(name=row['info_name'], region=row['region'], subregion=row['subregion'],
+                        capital=row['capital'], currencies=tuple(json.loads(row['currencies'])),
+                        languages=tuple(json.loads(row['languages'])), population=row['population'],
+                        wiki=row['wiki'], alpha2=row['alpha2'], alpha3=row['alpha3'])
+
+
+def get_facts_stats():
+    """Return the hits and misses of the country facts store."""
+    cache_info = get_country_facts.cache_info()
+    return {'hits': cache_info.hits, 'misses': cache_info.misses,
+            'size': cache_info.currsize, 'max_size': cache_info.maxsize}
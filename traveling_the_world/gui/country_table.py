@@ -0,0 +1,202 @@
+"""Compact on-disk table with the facts about every country and the cities in it.
+
+pycountry, countryinfo and geonamescache each load large json files into Python
+dicts. The table is generated out of them once, by `python manage.py
+build_country_table`, and every worker reads it through a memory-mapped,
+read-only SQLite connection instead of loading the libraries. When the table
+is missing or out of date, i.e. of an older schema or of other versions of the
+libraries, it is built on first use. The workers take a lock file for the
+build, so only one of them builds it and the others wait and read it."""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+from importlib import metadata
+
+from django.conf import settings
+
+# Increase it whenever the schema changes, so the old tables are rebuilt.
+SCHEMA_VERSION = 3
+# The table is rebuilt when the version of any of these libraries changes.
+LIBRARIES = ('pycountry', 'countryinfo', 'geonamescache')
+MMAP_SIZE = 64 * 1024 * 1024
+# Seconds for which a worker waits for another one to build the table.
+BUILD_LOCK_TIMEOUT = 300
+
+SCHEMA = """
+CREATE TABLE countries (
+    alpha2 TEXT PRIMARY KEY,
+    alpha3 TEXT NOT NULL,
+    numeric TEXT,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    official_name TEXT,
+    common_name TEXT,
+    info_name TEXT,
+    region TEXT,
+    subregion TEXT,
+    capital TEXT,
+    currencies TEXT,
+    languages TEXT,
+    population INTEGER,
+    wiki TEXT,
+    latitude REAL,
+    longitude REAL,
+    cities_to_visit INTEGER NOT NULL
+);
+CREATE TABLE cities (
+    geonameid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    country_code TEXT NOT NULL,
+    admin1code TEXT,
+    population INTEGER,
+    latitude REAL,
+    longitude REAL
+);
+CREATE TABLE biggest_cities (
+    country_code TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (country_code, rank)
+) WITHOUT ROWID;
+CREATE TABLE libraries (
+    name TEXT PRIMARY KEY,
+    version TEXT NOT NULL
+);
+CREATE INDEX cities_name ON cities (name COLLATE NOCASE);
+"""
+
+_local = threading.local()
+_build_lock = threading.Lock()
+
+
+def get_path():
+    return settings.COUNTRY_TABLE_PATH
+
+
+def get_library_versions():
+    return {name: metadata.version(name) for name in LIBRARIES}
+
+
+def _country_info(country):
+    """The countryinfo record of a pycountry country, or None if countryinfo doesn't know it."""
+    import countryinfo
+
+    for key in (country.name, country.alpha_2):
+        try:
+            info = countryinfo.CountryInfo(key).info()
+        except LookupError:
+            continue
+        if info.get('ISO', {}).get('alpha2') == country.alpha_2:
+            return info
+    return None
+
+
+def _country_rows():
+    import pycountry
+    from .countries import default_cities_to_visit
+
+    for position, country in enumerate(pycountry.countries):
+        info = _country_info(country) or {}
+        latlng = info.get('latlng') or [None, None]
+        yield (country.alpha_2, country.alpha_3, getattr(country, 'numeric', None), position, country.name,
+               getattr(country, 'official_name', None), getattr(country, 'common_name', None),
+               info.get('name'), info.get('region'), info.get('subregion'), info.get('capital'),
+               json.dumps(info.get('currencies') or []), json.dumps(info.get('languages') or []),
+               info.get('population'), info.get('wiki'), latlng[0], latlng[1],
+               default_cities_to_visit(country.name))
+
+
+def build(path=None):
+    """Generate the table from pycountry, countryinfo and geonamescache.
+    It is written to a temporary file first, so the readers never see half of it."""
+    from . import places
+
+    path = os.fspath(path or get_path())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(descriptor)
+    try:
+        connection = sqlite3.connect(temporary_path)
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.executemany(f"INSERT INTO countries VALUES ({', '.join('?' * 18)})", _country_rows())
+            geonames = places.get_geonames()
+            connection.executemany(
+                "INSERT INTO cities VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((city['geonameid'], city['name'], city['countrycode'], city['admin1code'],
+                  city['population'], city['latitude'], city['longitude'])
+                 for city in geonames.get_cities().values()))
+            connection.executemany(
+                "INSERT INTO biggest_cities VALUES (?, ?, ?)",
+                ((country_code, rank, name)
+                 for country_code, names in places.build_city_index(geonames).items()
+                 for rank, name in enumerate(names)))
+            connection.executemany("INSERT INTO libraries VALUES (?, ?)", get_library_versions().items())
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        connection.execute("VACUUM")
+        connection.close()
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return path
+
+
+def _is_current(path):
+    if not os.path.exists(path):
+        return False
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            return False
+        return dict(connection.execute("SELECT name, version FROM libraries")) == get_library_versions()
+    finally:
+        connection.close()
+
+
+def _build_if_outdated(path):
+    """Build the table unless it is current. The exclusive lock of a SQLite file is held for the
+    build, so the other processes wait for it instead of building the same table at once."""
+    if _is_current(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock = sqlite3.connect(path + '.lock', timeout=BUILD_LOCK_TIMEOUT, isolation_level=None)
+    try:
+        lock.execute("BEGIN EXCLUSIVE")
+        # Another process may have built it while this one waited for the lock.
+        if not _is_current(path):
+            build(path)
+        lock.execute("COMMIT")
+    finally:
+        lock.close()
+
+
+def get_connection():
+    """Return the read-only connection of the current thread, building the table if needed."""
+    path = os.fspath(get_path())
+    connection = getattr(_local, 'connection', None)
+    if connection is not None and _local.path == path:
+        return connection
+    with _build_lock:
+        _build_if_outdated(path)
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+    connection.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    connection.row_factory = sqlite3.Row
+    _local.connection = connection
+    _local.path = path
+    return connection
+
+
+def close():
+    """Close the connection of the current thread, e.g. after the table is rebuilt."""
+    connection = getattr(_local, 'connection', None)
+    if connection is not None:
+        connection.close()
+        _local.connection = None
+
+
+def query(sql, parameters=()):
+    return get_connection().execute(sql, parameters).fetchall()
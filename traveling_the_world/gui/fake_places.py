@@ -0,0 +1,132 @@
+"""Local stand-in for Google Maps - Places, which replays recorded responses.
+
+It serves the textsearch, details and photo endpoints used by places.py from
+places_recordings.json. Pointing settings.PLACES_API_BASE_URL to its url lets the
+tests and the benchmarks run offline. In record mode the unknown requests are
+forwarded to Google and their responses are added to the recordings."""
+import json
+import threading
+import time
+import urllib.parse
+import requests
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+RECORDINGS_PATH = Path(__file__).resolve().parent / 'places_recordings.json'
+GOOGLE_BASE_URL = 'https://maps.googleapis.com/maps/api/place'
+
+
+class Recordings:
+    """Recorded responses keyed by endpoint and by query, pagetoken, place_id or photo_reference."""
+
+    def __init__(self, path=RECORDINGS_PATH):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        with open(self.path) as recordings_file:
+            self.data = json.load(recordings_file)
+
+    def get(self, endpoint, key):
+        return self.data.get(endpoint, {}).get(key)
+
+    def add(self, endpoint, key, value):
+        with self.lock:
+            self.data.setdefault(endpoint, {})[key] = value
+            with open(self.path, 'w') as recordings_file:
+                json.dump(self.data, recordings_file, indent=2, sort_keys=True)
+
+
+class FakePlacesHandler(BaseHTTPRequestHandler):
+    # The endpoints of the Places API and the parameter which identifies the recorded response.
+    ENDPOINTS = {
+        '/textsearch/json': ('textsearch', 'query'),
+        '/details/json': ('details', 'place_id'),
+        '/photo': ('photo', 'photo_reference'),
+    }
+    MISSING_RESPONSES = {
+        'textsearch': {'status': 'ZERO_RESULTS', 'results': []},
+        'details': {'status': 'NOT_FOUND'},
+    }
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parameters = dict(urllib.parse.parse_qsl(url.query))
+        if url.path not in self.ENDPOINTS:
+            self.send_json({'status': 'INVALID_REQUEST'}, status=404)
+            return
+        endpoint, key_name = self.ENDPOINTS[url.path]
+        if endpoint == 'textsearch' and 'pagetoken' in parameters:
+            # The next pages of a textsearch are recorded by their page token.
+            key_name = 'pagetoken'
+        key = parameters.get(key_name, '')
+        if self.server.delay:
+            # Simulate the latency of Google.
+            time.sleep(self.server.delay)
+
+        response = self.server.recordings.get(endpoint, key)
+        if response is None and self.server.record:
+            response = self.record(endpoint, url.path, parameters)
+            self.server.recordings.add(endpoint, key, response)
+
+        if endpoint == 'photo':
+            if response is None:
+                self.send_json({'status': 'NOT_FOUND'}, status=404)
+            else:
+                self.send_response(302)
+                self.send_header('Location', response)
+                self.end_headers()
+        elif response is None and key_name == 'pagetoken':
+            # Google answers so to the unknown and to the expired page tokens.
+            self.send_json({'status': 'INVALID_REQUEST', 'results': []})
+        else:
+            self.send_json(response or self.MISSING_RESPONSES.get(endpoint, {'status': 'INVALID_REQUEST'}))
+
+    def record(self, endpoint, path, parameters):
+        upstream = requests.get(GOOGLE_BASE_URL + path, params={**parameters, 'key': self.server.api_key},
+                                allow_redirects=False, timeout=10)
+        if endpoint == 'photo':
+            return upstream.headers.get('Location')
+        return upstream.json()
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakePlacesServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, recordings=None, record=False, api_key=None,
+                 verbose=False, delay=0):
+        super().__init__((host, port), FakePlacesHandler)
+        self.recordings = recordings or Recordings()
+        self.record = record
+        self.api_key = api_key
+        self.verbose = verbose
+        self.delay = delay
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve the requests from a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,108 @@
+"""Shared, connection-pooled HTTP client for the calls to Google Maps.
+
+All of the requests of a process go through one requests.Session, so the TLS
+connections are reused. Every request has connect and read timeouts, 5xx
+responses are retried with backoff by urllib3 and OVER_QUERY_LIMIT answers are
+retried by get_json. The calls are limited by the shared budgets of rate_limit.
+The latency of every endpoint is counted in get_stats() and in the metrics of
+the current request."""
+import threading
+import time
+import requests
+
+from contextlib import contextmanager
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+from . import rate_limit
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_session():
+    """Return the session of the process, creating it on the first call."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(total=settings.PLACES_HTTP_RETRIES,
+                              backoff_factor=settings.PLACES_HTTP_BACKOFF_FACTOR,
+                              status_forcelist=RETRY_STATUSES,
+                              allowed_methods=('GET',),
+                              raise_on_status=False)
+                adapter = HTTPAdapter(pool_maxsize=settings.PLACES_HTTP_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _record(endpoint, seconds, failed):
+    with _stats_lock:
+        stats = _stats.setdefault(endpoint, {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['count'] += 1
+        stats['errors'] += int(failed)
+        stats['total_ms'] += seconds * 1000
+        stats['max_ms'] = max(stats['max_ms'], seconds * 1000)
+    metrics.record_outbound(seconds)
+
+
+def get_stats():
+    """Return the number of calls, errors and their latency per endpoint."""
+    with _stats_lock:
+        return {endpoint: dict(stats) for endpoint, stats in _stats.items()}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+@contextmanager
+def track(endpoint):
+    """Count the latency of an outbound call which isn't sent by get(), e.g. by geopy."""
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        _record(endpoint, time.perf_counter() - start, failed)
+
+
+def get(endpoint, url, params=None, allow_redirects=True):
+    """Send a GET request through the shared session. The endpoint is
+    a short name (e.g. 'textsearch') under which the latency is counted
+    and whose budget in settings.PLACES_RATE_LIMITS is spent."""
+    timeout = (settings.PLACES_HTTP_CONNECT_TIMEOUT, settings.PLACES_HTTP_READ_TIMEOUT)
+    rate_limit.acquire(endpoint)
+    start = time.perf_counter()
+    failed = True
+    try:
+        response = get_session().get(url, params=params, timeout=timeout, allow_redirects=allow_redirects)
+        failed = response.status_code >= 400
+        return response
+    finally:
+        _record(endpoint, time.perf_counter() - start, failed)
+
+
+def get_json(endpoint, url, params=None):
+    """Send a GET request and return its json. Answers with the status
+    OVER_QUERY_LIMIT are retried with exponential backoff."""
+    for attempt in range(settings.PLACES_HTTP_RETRIES + 1):
+        data = get(endpoint, url, params).json()
+        if data.get('status') != 'OVER_QUERY_LIMIT':
+            break
+        if attempt < settings.PLACES_HTTP_RETRIES:
+            time.sleep(settings.PLACES_HTTP_BACKOFF_FACTOR * 2 ** attempt)
+    return data
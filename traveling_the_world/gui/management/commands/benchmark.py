@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gui import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Run the benchmarks of the gui app and print their results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help=f"Benchmarks to run, out of {', '.join(sorted(benchmarks.BENCHMARKS))}. "
+                                 "All of them are run by default.")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="How many times every measured call is repeated.")
+        parser.add_argument('--output', help="Write the results to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        names = options['names'] or sorted(benchmarks.BENCHMARKS)
+        unknown = [name for name in names if name not in benchmarks.BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(unknown)}.")
+        results = {}
+        for name in names:
+            results[name] = benchmarks.BENCHMARKS[name](options['repeat'])
+        report = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,17 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from gui import country_table
+
+
+class Command(BaseCommand):
+    help = ("Generate the table with the facts about the countries and their cities out of "
+            "pycountry, countryinfo and geonamescache.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Where to write the table. Defaults to settings.COUNTRY_TABLE_PATH.")
+
+    def handle(self, *args, **options):
+        path = country_table.build(options['output'])
+        self.stdout.write(f"Built the country table in {path} ({os.path.getsize(path) // 1024} KiB).")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from gui import fake_places
+from gui import places
+
+
+class Command(BaseCommand):
+    help = ("Serve the recorded Google Maps - Places responses locally. "
+            "Point PLACES_API_BASE_URL to the printed url to use it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--recordings', default=str(fake_places.RECORDINGS_PATH),
+                            help="The json file with the recorded responses.")
+        parser.add_argument('--delay', type=float, default=0,
+                            help="Seconds to wait before every answer, to simulate the latency of Google.")
+        parser.add_argument('--record', action='store_true',
+                            help="Forward the unknown requests to Google and record their responses.")
+
+    def handle(self, *args, **options):
+        server = fake_places.FakePlacesServer(options['host'], options['port'],
+                                              fake_places.Recordings(options['recordings']),
+                                              record=options['record'], api_key=places.API_KEY,
+                                              verbose=True, delay=options['delay'])
+        self.stdout.write(f"Serving the Places stand-in on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from gui import admin
+from gui import models
+
+
+class Command(BaseCommand):
+    help = "Rebuild the visit counters of the countries from the countries lists of all users."
+
+    def handle(self, *args, **options):
+        admin.CountryVisitsAdmin.rebuild()
+        self.stdout.write(f"Rebuilt the visit counters of {models.CountryVisits.objects.count()} countries.")
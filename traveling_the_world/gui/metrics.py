@@ -0,0 +1,157 @@
+"""Per-request instrumentation of the views.
+
+For every request, MetricsMiddleware counts the SQL queries and the outbound
+calls to Google Maps and Nominatim, and it measures their time and the total
+latency. The counters of the current request live in a context variable, so
+they follow the request into sync_to_async and asyncio.to_thread. The SQL
+queries are counted by an execute wrapper, which is installed on every
+database connection when it is created. The latest samples of every view
+are kept, and their percentiles are served by views.metrics_view."""
+import threading
+import time
+
+from collections import deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+PERCENTILES = (50, 90, 99)
+FIELDS = ('total_ms', 'sql_queries', 'sql_ms', 'outbound_calls', 'outbound_ms')
+
+_current = ContextVar('request_metrics', default=None)
+
+_samples = {}
+_samples_lock = threading.Lock()
+
+
+class RequestMetrics:
+    """Counters of a single request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.outbound_calls = 0
+        self.outbound_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add_sql(self, seconds):
+        with self.lock:
+            self.sql_queries += 1
+            self.sql_seconds += seconds
+
+    def add_outbound(self, seconds):
+        with self.lock:
+            self.outbound_calls += 1
+            self.outbound_seconds += seconds
+
+    def as_dict(self):
+        return {
+            'total_ms': (time.perf_counter() - self.start) * 1000,
+            'sql_queries': self.sql_queries,
+            'sql_ms': self.sql_seconds * 1000,
+            'outbound_calls': self.outbound_calls,
+            'outbound_ms': self.outbound_seconds * 1000,
+        }
+
+
+def record_outbound(seconds):
+    """Count an outbound call of the current request, if there is one."""
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.add_outbound(seconds)
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    """Execute wrapper which counts the queries of the current request."""
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.add_sql(time.perf_counter() - start)
+
+
+def install_sql_wrapper(sender, connection, **kwargs):
+    """Receiver of connection_created."""
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+def add_sample(view_name, sample):
+    with _samples_lock:
+        if view_name not in _samples:
+            _samples[view_name] = deque(maxlen=settings.METRICS_SAMPLES_PER_VIEW)
+        _samples[view_name].append(sample)
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of a sorted list."""
+    index = max(0, -(-len(sorted_values) * percent // 100) - 1)
+    return sorted_values[index]
+
+
+def get_summary():
+    """Return the number of samples and the percentiles of every field per view."""
+    with _samples_lock:
+        samples = {view_name: list(view_samples) for view_name, view_samples in _samples.items()}
+    summary = {}
+    for view_name, view_samples in samples.items():
+        view_summary = {'count': len(view_samples)}
+        for field in FIELDS:
+            values = sorted(sample[field] for sample in view_samples)
+            view_summary[field] = {f'p{percent}': round(percentile(values, percent), 3)
+                                   for percent in PERCENTILES}
+        summary[view_name] = view_summary
+    return summary
+
+
+def reset():
+    with _samples_lock:
+        _samples.clear()
+
+
+class MetricsMiddleware:
+    """Record the metrics of every request. In DEBUG they are also sent as response headers."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _current.set(RequestMetrics())
+        try:
+            response = self.get_response(request)
+            self.finish(request, response, _current.get())
+        finally:
+            _current.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        token = _current.set(RequestMetrics())
+        try:
+            response = await self.get_response(request)
+            self.finish(request, response, _current.get())
+        finally:
+            _current.reset(token)
+        return response
+
+    def finish(self, request, response, request_metrics):
+        sample = request_metrics.as_dict()
+        match = getattr(request, 'resolver_match', None)
+        add_sample(match.view_name if match else 'unresolved', sample)
+        if settings.DEBUG:
+            response['X-SQL-Queries'] = str(sample['sql_queries'])
+            response['X-Outbound-Calls'] = str(sample['outbound_calls'])
+            response['Server-Timing'] = (f"sql;dur={sample['sql_ms']:.3f}, "
+                                         f"outbound;dur={sample['outbound_ms']:.3f}, "
+                                         f"total;dur={sample['total_ms']:.3f}")
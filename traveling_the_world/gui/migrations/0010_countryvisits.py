@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_visits(apps, schema_editor):
+    Country = apps.get_model('gui', 'Country')
+    CountryVisits = apps.get_model('gui', 'CountryVisits')
+    visits = Country.objects.filter(visited=True).values_list('name').annotate(visits=Count('id'))
+    CountryVisits.objects.bulk_create([CountryVisits(name=name, visits=count) for name, count in visits])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0009_country_countries_list'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountryVisits',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('visits', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='country',
+            name='countries_list',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='countries', to='gui.countrylist'),
+        ),
+        migrations.RunPython(count_visits, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0010_countryvisits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='photo_url',
+            field=models.URLField(blank=True, default='', max_length=2000),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='place_id',
+            field=models.CharField(blank=True, default='', max_length=300),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0011_destination_place'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='photo_reference',
+            field=models.CharField(blank=True, default='', max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='place_fetched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:16
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicates(apps, schema_editor):
+    """Keep one row per country of a list, the visited one if there is one, and recount the visits."""
+    Country = apps.get_model('gui', 'Country')
+    CountryVisits = apps.get_model('gui', 'CountryVisits')
+    duplicates = (Country.objects.values('countries_list', 'name')
+                  .annotate(rows=Count('id')).filter(rows__gt=1))
+    for duplicate in duplicates:
+        rows = Country.objects.filter(countries_list=duplicate['countries_list'], name=duplicate['name'])
+        kept = rows.order_by('-visited', 'pk').first()
+        rows.exclude(pk=kept.pk).delete()
+    if duplicates:
+        visits = Country.objects.filter(visited=True).values_list('name').annotate(visits=Count('id'))
+        CountryVisits.objects.all().delete()
+        CountryVisits.objects.bulk_create([CountryVisits(name=name, visits=count) for name, count in visits])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0012_destination_place_fetched_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='country',
+            constraint=models.UniqueConstraint(fields=('countries_list', 'name'), name='unique_country_per_list'),
+        ),
+    ]
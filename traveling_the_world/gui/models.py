@@ -1,4 +1,8 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 
@@ -17,10 +21,25 @@ class Destination(models.Model):
     # Country with longest name is United Kingdom of Great Britain and Northern Ireland (46 letters).
     list_name = models.ForeignKey(DreamDestinationsList, on_delete=models.CASCADE,
                                   related_name='items')
+    # Resolved through Google Maps - Places in the background, after the destination is added.
+    place_id = models.CharField(max_length=300, blank=True, default='')
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    photo_reference = models.CharField(max_length=1000, blank=True, default='')
+    photo_url = models.URLField(max_length=2000, blank=True, default='')
+    # When the place was last resolved. An empty place_id after that means Google doesn't know it.
+    place_fetched_at = models.DateTimeField(null=True, blank=True)
     
     def __str__(self):
         return f"{self.destination_name}, {self.country}"
 
+    def is_place_stale(self):
+        """Whether the place has to be resolved again, by settings.PLACES_DESTINATION_MAX_AGE."""
+        if self.place_fetched_at is None:
+            return True
+        max_age = timedelta(seconds=settings.PLACES_DESTINATION_MAX_AGE)
+        return timezone.now() - self.place_fetched_at > max_age
+
 
 class CountryList(models.Model):
     countries_in_the_world = models.CharField(max_length = 50, default = "Countries List")
@@ -36,5 +55,20 @@ class Country(models.Model):
     countries_list = models.ForeignKey(CountryList, on_delete=models.CASCADE,
                                        related_name='countries')
 
+    class Meta:
+        # A country has one row per user, so two quick first touches can't create two of them.
+        constraints = [
+            models.UniqueConstraint(fields=['countries_list', 'name'], name='unique_country_per_list'),
+        ]
+
+    def __str__(self):
+        return f"{self.name}"
+
+class CountryVisits(models.Model):
+    # Denormalized number of users that have visited a country, kept current by visit_item_view
+    # and by the signals of Country (see GuiConfig.ready).
+    name = models.CharField(max_length=50, unique=True)
+    visits = models.IntegerField(default=0)
+
     def __str__(self):
-        return f"{self.name}"
\ No newline at end of file
+        return f"{self.name} - {self.visits}"
@@ -1,17 +1,132 @@
 import os
-import pycountry
+import contextvars
+import threading
+import time
 import urllib
-import requests
 import geonamescache
-import countryinfo
 
+from concurrent.futures import ThreadPoolExecutor
 from geopy.geocoders import Nominatim
 from dotenv import load_dotenv
+from django.conf import settings
+
+from . import caching
+from . import countries
+from . import country_table
+from . import http_client
+from . import rate_limit
 
 load_dotenv()
 
 API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 
+# Only the final answers of Google are cached. Errors such as REQUEST_DENIED are requested again.
+CACHEABLE_STATUSES = ('OK', 'ZERO_RESULTS')
+# A textsearch has at most 3 pages of 20 results. The token of the next page is
+# valid a few seconds after it is issued, so it is requested up to this many times.
+MAX_TEXTSEARCH_PAGES = 3
+PAGE_TOKEN_ATTEMPTS = 3
+
+# Heavy resources shared by the whole process. They are loaded lazily, on first use, or by preload().
+_geonames = None
+_geolocator = None
+_resources_lock = threading.RLock()
+
+
+def get_geonames():
+    """The geonames data is loaded only to build the country table, the workers read the table."""
+    global _geonames
+    if _geonames is None:
+        with _resources_lock:
+            if _geonames is None:
+                _geonames = geonamescache.GeonamesCache()
+    return _geonames
+
+
+def get_geolocator():
+    global _geolocator
+    if _geolocator is None:
+        with _resources_lock:
+            if _geolocator is None:
+                _geolocator = Nominatim(user_agent="travel_around_the_world")
+    return _geolocator
+
+
+def preload():
+    """Load all of the shared resources, so the first request of a worker doesn't wait for them."""
+    country_table.get_connection()
+    countries.get_catalogue()
+    get_geolocator()
+
+
+def build_city_index(geonames):
+    """Map every country code to the names of its top 30 cities by population. For the USA
+    the top 5 cities of every state are taken instead, sorted by population as well."""
+    cities_by_country = {}
+    for city in geonames.get_cities().values():
+        cities_by_country.setdefault(city['countrycode'], []).append(city)
+
+    city_index = {}
+    for country_code, list_of_cities in cities_by_country.items():
+        # The sort is stable, so the cities with equal population keep the order of geonamescache.
+        list_of_cities.sort(reverse=True,key=lambda item: item.get('population'))
+        city_index[country_code] = [city['name'] for city in list_of_cities[0:30]]
+
+    cities_by_state = {}
+    for city in cities_by_country.get('US', []):
+        cities_by_state.setdefault(city['admin1code'], []).append(city)
+    usa_cities = []
+    for state in geonames.get_us_states().keys():
+        usa_cities.extend(cities_by_state.get(state, [])[0:5])
+    usa_cities.sort(reverse=True,key=lambda item: item.get('population'))
+    city_index['US'] = [city['name'] for city in usa_cities]
+    return city_index
+
+
+def find_coordinates_offline(place_str):
+    """Return the (latitude, longitude) of a country, a city or a 'city, country' string from the
+    country table, or None if place_str isn't a plain name of them. A city is the most populated
+    one with this name. The countries are matched only by their names, so a code such as '100'
+    or a city which is also a code is left to the cities and to Nominatim."""
+    country_code = countries.find_country_code(place_str, names_only=True)
+    if country_code is not None:
+        rows = country_table.query("SELECT latitude, longitude FROM countries WHERE alpha2 = ?",
+                                   (country_code,))
+    else:
+        city, _, country = str(place_str).rpartition(',')
+        if city:
+            country_code = countries.find_country_code(country, names_only=True)
+            if country_code is None:
+                return None
+            rows = country_table.query("SELECT latitude, longitude FROM cities "
+                                       "WHERE name = ? COLLATE NOCASE AND country_code = ? "
+                                       "ORDER BY population DESC LIMIT 1", (city.strip(), country_code))
+        else:
+            rows = country_table.query("SELECT latitude, longitude FROM cities WHERE name = ? COLLATE NOCASE "
+                                       "ORDER BY population DESC LIMIT 1", (country.strip(),))
+    if not rows or rows[0]['latitude'] is None:
+        return None
+    return (rows[0]['latitude'], rows[0]['longitude'])
+
+
+def get_place_details(place_id):
+    """Send a details request for a place and return its json. The responses are cached by place_id."""
+    URL_DETAILS = f'{settings.PLACES_API_BASE_URL}/details/json'
+
+    def request():
+        return http_client.get_json('details', URL_DETAILS, {'place_id': place_id, 'key': API_KEY})
+
+    return caching.get_or_set('details', (place_id,), request,
+                              lambda data: data.get('status') in CACHEABLE_STATUSES)
+
+
+def _get_place_details_or_none(place_id):
+    try:
+        return get_place_details(place_id)
+    except Exception:
+        return None
+
+
 class Place:
     """This class represents either a country/city or a tourist attraction."""
     
@@ -27,30 +142,34 @@ class Place:
         self.rating = 0
         self.user_ratings_total = 0
         
-    def set_details(self):
-        URL_DETAILS = 'https://maps.googleapis.com/maps/api/place/details/json'
-        parameters = {'place_id':self.place_id, 'key': API_KEY}
-        curr_request = requests.get(url = URL_DETAILS, params = parameters)
-        detailed_data = curr_request.json()
+    @classmethod
+    def from_result(cls, result, is_attraction):
+        """Create a place out of a result of a textsearch."""
+        geometry = (result['geometry']['location']['lat'], result['geometry']['location']['lng'])
+        return cls(result['place_id'], geometry, result['name'], is_attraction)
+
+    def set_details(self, detailed_data = None):
+        """Set the details of the place out of the json of a details request,
+        which is requested (or read from the cache) if it isn't given."""
+        if detailed_data is None:
+            detailed_data = get_place_details(self.place_id)
         
         self.formatted_address = detailed_data['result']['formatted_address']
         self.types = detailed_data['result']['types']
-        self.photo_reference = detailed_data['result']['photos'][0]['photo_reference']
 
         if self.is_attraction:
-            # There is no else, because they have a default value None or 0.
-            try:
-                self.rating = detailed_data['result']['rating']
-                self.user_ratings_total = detailed_data['result']['user_ratings_total']
-            except:
-                print("This place has no rating and/or user_ratings. It won't be suggested for a visit.")
-            try:
-                with detailed_data['result']['formatted_phone_number'] as phone_number:
-                    self.formatted_phone_number = phone_number
-                with detailed_data['result']['opening_hours'] as opening_hours:
-                    self.opening_hours = opening_hours
-            except:
-                print("This place has no formatted_phone_number and/or information about openning hours.")
+            # The places without ratings keep the default 0, so they aren't suggested for a visit.
+            self.rating = detailed_data['result'].get('rating', 0)
+            self.user_ratings_total = detailed_data['result'].get('user_ratings_total', 0)
+            # Not every place has a formatted_phone_number and/or information about openning hours.
+            self.formatted_phone_number = detailed_data['result'].get('formatted_phone_number')
+            self.opening_hours = detailed_data['result'].get('opening_hours')
+
+        # Last, so the rating is set even for the places without photos, which raise KeyError here.
+        self.photo_reference = detailed_data['result']['photos'][0]['photo_reference']
+
+    def has_details(self):
+        return hasattr(self, 'formatted_address')
 
     def get_photo_reference(self):
         try:
@@ -60,12 +179,21 @@ class Place:
             photo = self.photo_reference
         return photo
     
-    def get_photo_url(self):
-        URL_PHOTO = 'https://maps.googleapis.com/maps/api/place/photo?'
-        parameters = {'maxwidth':'4000', 'photo_reference':self.get_photo_reference(), 'key': API_KEY}
-        photo_request = URL_PHOTO + urllib.parse.urlencode(parameters)
-        response = requests.get(photo_request)
-        return response.url
+    def get_photo_url(self, maxwidth = '4000'):
+        photo_reference = self.get_photo_reference()
+
+        def resolve():
+            URL_PHOTO = f'{settings.PLACES_API_BASE_URL}/photo?'
+            parameters = {'maxwidth':maxwidth, 'photo_reference':photo_reference, 'key': API_KEY}
+            photo_request = URL_PHOTO + urllib.parse.urlencode(parameters)
+            # The endpoint redirects to the image. Only the redirect is read, not the image itself.
+            response = http_client.get('photo', photo_request, allow_redirects = False)
+            return response.headers.get('Location')
+
+        photo_url = caching.get_or_set('photo', (photo_reference, maxwidth), resolve)
+        if photo_url is None:
+            raise KeyError("Unable to resolve the url of this photo.")
+        return photo_url
     
     def get_rating_tuple(self):
         if self.is_attraction:
@@ -81,18 +209,37 @@ class Place:
             
     
 class PlacesUtilities:
-    
-    def __init__(self):
-        self.geonames = geonamescache.GeonamesCache()
-        self.geolocator = Nominatim(user_agent="travel_around_the_world")
+    """The geonames cache and the geolocator are shared by all instances in the process."""
+
+    @property
+    def geonames(self):
+        return get_geonames()
+
+    @property
+    def geolocator(self):
+        return get_geolocator()
         
     def get_longitude_latitude_tuple(self, place_str):
         """This function is able to extract the longitude and latitude 
         only if place_str is a valid city or country. """
-        location = self.geolocator.geocode(place_str)
-        if location is not None:
+        # The names of the countries and the cities are resolved offline. Only the
+        # rest is geocoded by Nominatim, which allows 1 request per second, and cached.
+        coordinates = find_coordinates_offline(place_str)
+        if coordinates is not None:
+            return coordinates
+
+        def geocode():
+            rate_limit.acquire('nominatim')
+            with http_client.track('nominatim'):
+                location = self.geolocator.geocode(place_str)
+            if location is None:
+                return None
             return (location.latitude, location.longitude)
-        raise AttributeError("Unable to extract latitude and longitude of this location.")
+
+        coordinates = caching.get_or_set('geocode', (place_str,), geocode)
+        if coordinates is None:
+            raise AttributeError("Unable to extract latitude and longitude of this location.")
+        return coordinates
     
     @staticmethod
     def find_places_given_place_type_and_radius(place, radius=50000, type = ""):
@@ -100,16 +247,13 @@ class PlacesUtilities:
         (given city and radius). Only information about the place_id, geometry/location and name will be saved.
         If type is not specified, then the query will be only for a specified place (country, province or city).
         """
-        # Basic url for text search via Google Maps API - Places.
-        URL = 'https://maps.googleapis.com/maps/api/place/textsearch/json'
         # When the city is specified in the query, it overrides the location parameter.
         # If we pass the desired longitude and latitude, it is possible for them to be overriden by
         # other factors such as nearby location.
         if type == '':
             query = place
-            parameters = {'query':query, 'key': API_KEY}
-            curr_request = requests.get(url = URL, params = parameters)
-            data = curr_request.json()
+            parameters = {'query':query}
+            data = PlacesUtilities.text_search(parameters)
             place_id = data['results'][0]['place_id']
             geometry = (data['results'][0]['geometry']['location']['lat'], 
                         data['results'][0]['geometry']['location']['lng'])
@@ -117,50 +261,133 @@ class PlacesUtilities:
             return [Place(place_id, geometry, name, False)]
        
         query = type + ' in ' + place
-        parameters = {'query':query, 'radius': radius, 'key':API_KEY}
-        curr_request = requests.get(url = URL, params = parameters)
-        data = curr_request.json()
+        parameters = {'query':query, 'radius': radius}
+        data = PlacesUtilities.text_search(parameters)
         list_of_attractions = []
         for attraction in data['results']:
-            place_id = attraction['place_id']
-            geometry = (attraction['geometry']['location']['lat'], attraction['geometry']['location']['lng'])
-            name = attraction['name']
-            curr_place = Place(place_id, geometry, name, True)
-            list_of_attractions.append(curr_place)
+            list_of_attractions.append(Place.from_result(attraction, True))
         return list_of_attractions
 
+    @staticmethod
+    def iter_places_given_place_type_and_radius(place, radius=50000, type = "", max_results=None, failures=None):
+        """Generator version of find_places_given_place_type_and_radius. It follows the next pages
+        of the textsearch and yields the places as every page arrives, so the caller can use the
+        first ones without waiting for the rest. At most max_results places are yielded.
+        The statuses of the pages which failed, e.g. OVER_QUERY_LIMIT, are appended to failures."""
+        if type == '':
+            yield from PlacesUtilities.find_places_given_place_type_and_radius(place)[:max_results]
+            return
+
+        parameters = {'query': type + ' in ' + place, 'radius': radius}
+        data = PlacesUtilities.text_search(parameters)
+        count = 0
+        for page in range(1, MAX_TEXTSEARCH_PAGES + 1):
+            if failures is not None and data.get('status') not in CACHEABLE_STATUSES:
+                failures.append(data.get('status'))
+            for attraction in data.get('results', []):
+                if max_results is not None and count >= max_results:
+                    return
+                yield Place.from_result(attraction, True)
+                count += 1
+            token = data.get('next_page_token')
+            if token is None or page == MAX_TEXTSEARCH_PAGES:
+                return
+            data = PlacesUtilities.text_search_next_page(parameters, page + 1, token)
+
+    @staticmethod
+    def find_photo_url(query):
+        """Return the url of the photo of the first place found for a query, or None if it has
+        no photo. Raises IndexError if nothing is found. The urls are cached by query."""
+        def resolve():
+            place_obj = PlacesUtilities.find_places_given_place_type_and_radius(query)
+            try:
+                return place_obj[0].get_photo_url()
+            except KeyError:
+                # An empty url is cached as well, so the places without photos aren't requested again.
+                return ''
+
+        return caching.get_or_set('background', (query,), resolve) or None
+
+    @staticmethod
+    def hydrate(places, max_workers=None, failures=None):
+        """Set the details of many places at once. The details of every place_id are requested
+        only once, by at most max_workers threads at a time, and the cached ones aren't requested
+        at all. The places whose details can't be requested are left without them, and their
+        place_ids are appended to failures."""
+        max_workers = max_workers or settings.PLACES_HYDRATE_WORKERS
+        places_by_id = {}
+        for place in places:
+            if not place.has_details():
+                places_by_id.setdefault(place.place_id, []).append(place)
+        if not places_by_id:
+            return places
+
+        place_ids = list(places_by_id)
+        # Every request runs in a copy of the context, so it is counted in the metrics of the current request.
+        contexts = [contextvars.copy_context() for _ in place_ids]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(place_ids))) as executor:
+            details = executor.map(lambda context, place_id: context.run(_get_place_details_or_none, place_id),
+                                   contexts, place_ids)
+            for place_id, detailed_data in zip(place_ids, details):
+                if failures is not None and (detailed_data is None or
+                                             detailed_data.get('status') not in CACHEABLE_STATUSES):
+                    failures.append(place_id)
+                if detailed_data is None or 'result' not in detailed_data:
+                    continue
+                for place in places_by_id[place_id]:
+                    try:
+                        place.set_details(detailed_data)
+                    except KeyError:
+                        # There are no photos of this place.
+                        pass
+        return places
+
+    @staticmethod
+    def text_search(parameters):
+        """Send a textsearch request with the given parameters and return its json.
+        The responses are cached by their query, type and radius."""
+        # Basic url for text search via Google Maps API - Places.
+        URL = f'{settings.PLACES_API_BASE_URL}/textsearch/json'
+
+        def request():
+            return http_client.get_json('textsearch', URL, {**parameters, 'key': API_KEY})
+
+        cache_key = (parameters['query'], parameters.get('type', ''), parameters.get('radius', ''))
+        return caching.get_or_set('textsearch', cache_key, request,
+                                  lambda data: data.get('status') in CACHEABLE_STATUSES)
+
+    @staticmethod
+    def text_search_next_page(parameters, page, pagetoken):
+        """Send the textsearch request of the next page of a search and return its json.
+        The pages are cached by their number, together with the search parameters."""
+        URL = f'{settings.PLACES_API_BASE_URL}/textsearch/json'
+
+        def request():
+            for attempt in range(PAGE_TOKEN_ATTEMPTS):
+                # Google answers INVALID_REQUEST until the token is valid.
+                time.sleep(settings.PLACES_PAGE_TOKEN_DELAY)
+                data = http_client.get_json('textsearch', URL, {'pagetoken': pagetoken, 'key': API_KEY})
+                if data.get('status') != 'INVALID_REQUEST':
+                    break
+            return data
+
+        cache_key = (parameters['query'], parameters.get('type', ''), parameters.get('radius', ''), page)
+        return caching.get_or_set('textsearch', cache_key, request,
+                                  lambda data: data.get('status') in CACHEABLE_STATUSES)
+
     def find_biggest_cities_by_country_name(self, country_name):
         """This function has to retrieve the names of top 30 of the biggest cities in a country by population.
         In case that the specified country has less than 30 cities with population above 15000 people, all of 
-        them will be appended to the list."""
-        list_of_cities = []
-        if self.is_country_valid(country_name):
-            country_code = countryinfo.CountryInfo(country_name).iso()['alpha2']
-        else:
-            raise LookupError
-
-        country_code = countryinfo.CountryInfo(country_name).iso()['alpha2']
-        for city in self.geonames.get_cities().values():
-            if city['countrycode'] == country_code:
-                list_of_cities.append(city)
-        if country_code == 'US':
-            usa_cities = []
-            for state in self.geonames.get_us_states().keys():
-                curr_state_list = [city for city in list_of_cities if city['admin1code'] == state]
-                curr_state_list.sort(reverse=True,key=lambda item: item.get('population'))
-                usa_cities.extend(curr_state_list[0:5])
-            usa_cities.sort(reverse=True,key=lambda item: item.get('population'))
-            return [city['name'] for city in usa_cities]
-        list_of_cities.sort(reverse=True,key=lambda item: item.get('population'))
-        return [city['name'] for city in list_of_cities[0:30]]
+        them will be appended to the list. The list is empty for an unknown country."""
+        # Only the code is needed, so the countries without facts have their cities as well.
+        country_code = countries.find_country_code(country_name)
+        if country_code is None:
+            return []
+
+        rows = country_table.query("SELECT name FROM biggest_cities WHERE country_code = ? ORDER BY rank",
+                                   (country_code,))
+        return [row['name'] for row in rows]
         
-    
     @staticmethod
     def is_country_valid(country_name):
-        try:
-            pycountry.countries.lookup(country_name)
-        except LookupError:
-            print('Can not find this country. Maybe it is invalid?')
-            return False
-        return True
-    
\ No newline at end of file
+        return countries.normalize_country_name(country_name) is not None
@@ -0,0 +1,102 @@
+"""Background resolution of the dream destinations through Google Maps - Places.
+
+When a destination is added, its place_id, coordinates and photo url are
+resolved by a thread pool of the process and stored on the row, so the later
+pages read them from the database instead of waiting for Google. They are
+resolved again once they are older than settings.PLACES_DESTINATION_MAX_AGE. The job is
+queued after the transaction commits, so it always sees the new row. With
+settings.PLACES_PREFETCH_INLINE the job runs in the request instead, which
+keeps the tests deterministic."""
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import caching
+from . import models
+from .places import PlacesUtilities
+
+logger = logging.getLogger(__name__)
+
+PHOTO_MAXWIDTH = '4000'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.PLACES_PREFETCH_WORKERS,
+                                               thread_name_prefix='places-prefetch')
+    return _executor
+
+
+def fetch_place(destination):
+    """Resolve a destination through Google Maps. Return the fields of its row to update,
+    or None if it can't be resolved now. There are no queries, so it runs in any thread."""
+    query = str(destination)
+    try:
+        place = PlacesUtilities.find_places_given_place_type_and_radius(query)[0]
+    except IndexError:
+        if PlacesUtilities.text_search({'query': query}).get('status') != 'ZERO_RESULTS':
+            logger.warning("Unable to resolve the destination '%s'.", destination)
+            return None
+        # Google doesn't know it. It isn't requested again until it is stale.
+        return {'place_id': '', 'latitude': None, 'longitude': None, 'photo_reference': '',
+                'photo_url': '', 'place_fetched_at': timezone.now()}
+    except Exception:
+        logger.warning("Unable to resolve the destination '%s'.", destination)
+        return None
+    photo_reference = photo_url = ''
+    # On a refresh of a stale place, its details and photo url are requested again,
+    # because they may be cached for longer than PLACES_DESTINATION_MAX_AGE.
+    refresh = destination.place_fetched_at is not None
+    try:
+        if refresh:
+            caching.delete('details', (place.place_id,))
+        photo_reference = place.get_photo_reference()
+        if refresh:
+            caching.delete('photo', (photo_reference, PHOTO_MAXWIDTH))
+        photo_url = place.get_photo_url(PHOTO_MAXWIDTH)
+    except Exception:
+        # There will be no background picture.
+        pass
+    return {'place_id': place.place_id, 'latitude': place.latitude, 'longitude': place.longitude,
+            'photo_reference': photo_reference, 'photo_url': photo_url, 'place_fetched_at': timezone.now()}
+
+
+def resolve_destination(destination_pk):
+    """Resolve a destination through Google Maps and store the result on its row.
+    Returns False if the destination was deleted or Google doesn't know it."""
+    try:
+        destination = models.Destination.objects.get(pk=destination_pk)
+    except models.Destination.DoesNotExist:
+        return False
+    fields = fetch_place(destination)
+    if fields is None:
+        return False
+    # update() instead of save(), so a concurrent change of the other fields isn't overwritten.
+    models.Destination.objects.filter(pk=destination_pk).update(**fields)
+    return bool(fields['place_id'])
+
+
+def _run(destination_pk):
+    try:
+        resolve_destination(destination_pk)
+    finally:
+        # The worker threads open their own database connections.
+        connection.close()
+
+
+def schedule(destination_pk):
+    """Resolve the destination after the current transaction commits."""
+    if settings.PLACES_PREFETCH_INLINE:
+        transaction.on_commit(lambda: resolve_destination(destination_pk))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_run, destination_pk))
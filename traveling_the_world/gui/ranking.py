@@ -0,0 +1,70 @@
+"""Top-k attractions of a city by a confidence-weighted rating.
+
+A rating of 5 out of 3 reviews shouldn't beat a rating of 4.7 out of 30000.
+The places are scored by the Bayesian average of their rating, which pulls
+the rating of the places with few reviews towards a prior rating. The
+candidates come page by page from the textsearch, the details of every page
+are requested at once, and only the best k of them are kept in a heap."""
+import heapq
+
+from itertools import islice
+
+from django.conf import settings
+
+from . import caching
+from .places import PlacesUtilities
+
+# The details of this many places are requested at once, as many as a textsearch page has.
+BATCH_SIZE = 20
+
+
+def bayesian_average(rating, user_ratings_total):
+    """Average of the rating of a place and of settings.PLACES_RANKING_PRIOR_RATING, weighted by
+    the number of ratings of the place and settings.PLACES_RANKING_PRIOR_WEIGHT."""
+    prior_rating = settings.PLACES_RANKING_PRIOR_RATING
+    prior_weight = settings.PLACES_RANKING_PRIOR_WEIGHT
+    return (rating * user_ratings_total + prior_rating * prior_weight) / (user_ratings_total + prior_weight)
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def rank_places(candidates, k, failures=None):
+    """Return the best k of the places by their Bayesian average, the best first.
+    The places without ratings aren't suggested. The ties keep the order of Google.
+    The place_ids whose details can't be requested are appended to failures."""
+    heap = []
+    position = 0
+    for batch in _batches(candidates, BATCH_SIZE):
+        PlacesUtilities.hydrate(batch, failures=failures)
+        for place in batch:
+            position += 1
+            if not place.has_details():
+                continue
+            rating, user_ratings_total = place.get_rating_tuple()
+            if not user_ratings_total:
+                continue
+            # The position breaks the ties, so the places themselves are never compared.
+            item = (bayesian_average(rating, user_ratings_total), -position, place)
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            else:
+                heapq.heappushpop(heap, item)
+    return [place for score, position, place in sorted(heap, reverse=True)]
+
+
+def find_top_attractions(city, type, k=10):
+    """Return the best k attractions of a type in a city, e.g. ('Amsterdam', 'museum').
+    The rankings are cached per city, type and k."""
+    failures = []
+
+    def rank():
+        candidates = PlacesUtilities.iter_places_given_place_type_and_radius(city, type=type, failures=failures)
+        return rank_places(candidates, k, failures)
+
+    # A ranking is cached only if every page and every details request succeeded, otherwise
+    # an empty or partial ranking would be served until it expires.
+    return caching.get_or_set('ranking', (city, type, k), rank, lambda top: not failures)
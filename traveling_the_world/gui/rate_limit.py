@@ -0,0 +1,101 @@
+"""Token buckets for the outbound calls, shared by all of the processes of the site.
+
+Every endpoint (e.g. 'nominatim' or 'textsearch') has a budget in
+settings.PLACES_RATE_LIMITS: a rate of tokens per second and the size of the
+bucket, i.e. the largest burst. The buckets are rows of a small SQLite file,
+so the workers coordinate through its write lock without any other service.
+A call which finds its bucket empty waits for the next token, unless the
+token would come after its deadline."""
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    endpoint TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+# Seconds for which a process waits for the write lock of another one.
+LOCK_TIMEOUT = 30
+
+_local = threading.local()
+
+
+class RateLimitExceeded(Exception):
+    """The next token of an endpoint comes after the deadline of the call."""
+
+
+def get_connection():
+    path = os.fspath(settings.PLACES_RATE_LIMIT_PATH)
+    connection = getattr(_local, 'connection', None)
+    if connection is not None and _local.path == path:
+        return connection
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Autocommit mode, so the transactions are started explicitly by BEGIN IMMEDIATE.
+    connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute(SCHEMA)
+    _local.connection = connection
+    _local.path = path
+    return connection
+
+
+def close():
+    connection = getattr(_local, 'connection', None)
+    if connection is not None:
+        connection.close()
+        _local.connection = None
+
+
+def _take(endpoint, rate, capacity):
+    """Take a token of the endpoint. Return 0 on success, otherwise the seconds until the next token."""
+    connection = get_connection()
+    # BEGIN IMMEDIATE takes the write lock, so no other process reads the bucket in between.
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        # The time is read under the lock, otherwise a process which waited for it would write
+        # an older time back and the next caller would be credited the same interval again.
+        now = time.time()
+        row = connection.execute("SELECT tokens, updated FROM buckets WHERE endpoint = ?", (endpoint,)).fetchone()
+        if row is None:
+            tokens = capacity
+        else:
+            elapsed = max(0.0, now - row[1])
+            tokens = min(capacity, row[0] + elapsed * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        connection.execute("INSERT OR REPLACE INTO buckets (endpoint, tokens, updated) VALUES (?, ?, ?)",
+                           (endpoint, tokens, now))
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return wait
+
+
+def acquire(endpoint, timeout=None):
+    """Wait until the budget of the endpoint allows one more call. Raises RateLimitExceeded
+    if that would take more than timeout seconds (settings.PLACES_RATE_LIMIT_TIMEOUT by default).
+    The endpoints without a budget are not limited."""
+    budget = settings.PLACES_RATE_LIMITS.get(endpoint)
+    if budget is None:
+        return
+    rate, capacity = budget
+    if timeout is None:
+        timeout = settings.PLACES_RATE_LIMIT_TIMEOUT
+    deadline = time.monotonic() + timeout
+    while True:
+        wait = _take(endpoint, rate, capacity)
+        if not wait:
+            return
+        if time.monotonic() + wait > deadline:
+            raise RateLimitExceeded(f"The rate limit of '{endpoint}' doesn't allow a call in {timeout} seconds.")
+        time.sleep(wait)
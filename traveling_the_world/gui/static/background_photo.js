@@ -0,0 +1,16 @@
+(function(){
+    // The background photo is loaded after the page, so the page doesn't wait for Google Maps.
+    var source = document.currentScript.dataset.source;
+    window.addEventListener('load', function(){
+        fetch(source).then(function (response) {
+            if (response.ok) {return response.json();}
+            return Promise.reject(response);
+        }).then(function (data) {
+            if (data['photo']) {
+                document.body.style.backgroundImage = "url('" + data['photo'] + "')";
+            }
+        }).catch(function (err) {
+            console.warn('Unable to load the background photo.', err);
+        });
+    });
+})();
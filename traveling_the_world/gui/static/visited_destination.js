@@ -13,7 +13,9 @@ window.onload = function(){
             input = this.querySelector('input');
             state = input.checked ? 0 : 1;
             console.log(state)
-            fetch('/visit_item?id=' + input.dataset.id + '&state=' + state).then(function (response) {
+            // Countries which the user has not touched yet have only a code and no id.
+            key = input.dataset.id ? 'id=' + input.dataset.id : 'code=' + input.dataset.code;
+            fetch('/visit_item?' + key + '&state=' + state).then(function (response) {
                 if (response.ok) {return response.json();}
                 return Promise.reject(response);
             }).then(function (data) {
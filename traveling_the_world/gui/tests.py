@@ -1,13 +1,59 @@
-from django.test import TestCase, Client
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import pycountry
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, Client, AsyncClient, override_settings
 from django.urls import reverse, resolve
 from django.contrib.auth.models import User
 from django.contrib.auth import views as auth_views
+from django.utils import timezone
 
 from . import models
 from . import views
 from . import forms
-
-class TestViews(TestCase):
+from . import admin
+from . import countries
+from . import caching
+from . import places
+from . import http_client
+from . import fake_places
+from . import benchmarks
+from . import country_table
+from . import prefetch
+from . import metrics
+from . import rate_limit
+from . import ranking
+
+class PlacesStandInMixin:
+    """Serve the recorded Places responses from a local stand-in server during the tests."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.places_server = fake_places.FakePlacesServer().start()
+        cls.places_settings = override_settings(PLACES_API_BASE_URL = cls.places_server.url)
+        cls.places_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.places_settings.disable()
+        cls.places_server.stop()
+
+
+class TestViews(PlacesStandInMixin, TestCase):
     REDIRECT_STATUS_CODE = 302
     SUCCESSFUL_STATUS_CODE = 200
     NOT_FOUND_STATUS_CODE = 404
@@ -16,6 +62,7 @@ class TestViews(TestCase):
     def setUp(self):
         """Prepare the test class."""
         self.client = Client()
+        caching.get_cache().clear()
         self.TEST_USER = User.objects.create_user(username = 'test_user',
                                                   password = self.PASSWORD, first_name = 'Testing')
 
@@ -64,15 +111,14 @@ class TestViews(TestCase):
                           password = self.PASSWORD)
         url = reverse(views.dream_destinations_view)
         response = self.client.get(url)
-        # Here we expect that the places.py functions work correctly.
-        URL = 'https://lh3.googleusercontent.com/places/ANXAkqF8-HtmrqT45pxsKvU1eiKJxakzuXBgu6p1-XDeaOBxHF9tvUD1T-bcrwhME7hU-0nBh6pjLLerYHlgmk7cIOhPJC-iuz32kt0=s1600-w3024'
 
         self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
         self.assertTemplateUsed(response, 'dream_list.html')
-        self.assertIn(URL, response.content.decode())
         self.assertIn('name', response.context)
         self.assertIn('items', response.context)
-        self.assertIn('photo', response.context)
+        # The background photo of Burgas is loaded after the page.
+        self.assertEqual(response.context['photo_source'], '/photo/')
+        self.assertIn('data-source="/photo/"', response.content.decode())
 
     def test_dream_destinations_list_valid_destination(self):
         """Test when the client has at least one valid 
@@ -88,50 +134,47 @@ class TestViews(TestCase):
         url = reverse(views.dream_destinations_view)
         response = self.client.get(url)
 
-        # Here we expect that the places.py functions work correctly.
-        URL = 'https://lh3.googleusercontent.com/places/ANXAkqFE6c9SV-XK_PtONP-tY-QPc5wxVDvnXXC4bR260GF-WRMBrmWICyUzhqoHSEq7mjuJ33CBu5Z30WIU5tpZC9Hb9iYwvG6q1IE=s1600-w4000'
         self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
         self.assertTemplateUsed(response, 'dream_list.html')
-        self.assertIn(URL, response.content.decode())
         self.assertIn('name', response.context)
         self.assertIn('items', response.context)
-        self.assertIn('photo', response.context)
+        self.assertEqual(response.context['photo_source'], f'/photo/?destination={destination.pk}')
 
-    def test_dream_destinations_list_invalid_destination(self):
-        """Test when the client has only invalid 
-        destination in the dream destinations list."""
+    def test_dream_destinations_view_number_of_queries(self):
+        """Test that the page reads the list and its items by one query each, however long the list is."""
         destination_list = models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
                                                                     dream_destinations_list = 'Test List')
-        destination = models.Destination.objects.create(destination_name = 'Invalid Destination',
-                                                        country = 'Bulgaria',
-                                                        list_name = destination_list)
-
+        models.Destination.objects.bulk_create([models.Destination(destination_name = f'City {index}',
+                                                                   country = 'Netherlands',
+                                                                   list_name = destination_list)
+                                                for index in range(20)])
         self.client.login(username = self.TEST_USER.username,
                           password = self.PASSWORD)
-        url = reverse(views.dream_destinations_view)
-        response = self.client.get(url)
 
-        self.assertEqual(response.status_code, self.NOT_FOUND_STATUS_CODE)
+        # The session, the user, the list and its items.
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse(views.dream_destinations_view))
 
-    def test_dream_destinations_list_no_photo_destination(self):
-        """Test when the client has a valid dream 
-        destination in the list, but there is no photo for it."""
+        self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
+        self.assertEqual(response.context['name'], 'Test List')
+        self.assertEqual(len(response.context['items']), 20)
+
+    def test_pages_do_not_call_places(self):
+        """Test that the pages are rendered without waiting for Google Maps."""
         destination_list = models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
                                                                     dream_destinations_list = 'Test List')
-        destination = models.Destination.objects.create(destination_name = 'Hungary',
-                                                        country = 'Hungary',
+        destination = models.Destination.objects.create(destination_name = 'Amsterdam',
+                                                        country = 'Netherlands',
                                                         list_name = destination_list)
-
         self.client.login(username = self.TEST_USER.username,
                           password = self.PASSWORD)
-        url = reverse(views.dream_destinations_view)
-        response = self.client.get(url)
 
-        self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
-        self.assertTemplateUsed(response, 'dream_list.html')
-        self.assertNotIn('photo', response.context)
-        self.assertIn('name', response.context)
-        self.assertIn('items', response.context)
+        with mock.patch.object(http_client, 'get_session', side_effect = AssertionError('Places was called')):
+            list_response = self.client.get(reverse(views.dream_destinations_view))
+            details_response = self.client.get(reverse(views.detailed_page) + f'?id={destination.pk}')
+
+        self.assertEqual(list_response.status_code, self.SUCCESSFUL_STATUS_CODE)
+        self.assertEqual(details_response.status_code, self.SUCCESSFUL_STATUS_CODE)
 
     def test_find_destination_view_not_logged_in(self):
         """Test when the client is trying to access the 
@@ -157,19 +200,18 @@ class TestViews(TestCase):
                                                                 countries_in_the_world = 'Test List')
         country = models.Country.objects.create(name = 'Netherlands', cities_to_visit = 30,
                                                 visited = True, countries_list = curr_countries_list)
+        admin.CountryVisitsAdmin.rebuild()
 
         self.client.login(username = self.TEST_USER.username,
                           password = self.PASSWORD)
         url = reverse(views.find_destination_view)
         response = self.client.get(url)
 
-        # Here we expect that the places.py functions work correctly.
         # We expect a background photo of the capital city.
         # Netherlands will be the most visited country, as it is the only one.
-        URL = 'https://lh3.googleusercontent.com/places/ANXAkqFE6c9SV-XK_PtONP-tY-QPc5wxVDvnXXC4bR260GF-WRMBrmWICyUzhqoHSEq7mjuJ33CBu5Z30WIU5tpZC9Hb9iYwvG6q1IE=s1600-w4000'
         self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
         self.assertTemplateUsed(response, 'destination.html')
-        self.assertIn(URL, response.content.decode())
+        self.assertEqual(response.context['photo_source'], '/photo/?country=NL')
 
     # Side note: there is a function validating the
     # countries, before ading them to the page and db.
@@ -209,19 +251,85 @@ class TestViews(TestCase):
         url = reverse(views.detailed_page) + f'?id={destination.pk}'
         response = self.client.get(url)
 
-        # Here we expect that the places.py functions work correctly.
-        URL = 'https://lh3.googleusercontent.com/places/ANXAkqFE6c9SV-XK_PtONP-tY-QPc5wxVDvnXXC4bR260GF-WRMBrmWICyUzhqoHSEq7mjuJ33CBu5Z30WIU5tpZC9Hb9iYwvG6q1IE=s1600-w4000'
         self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
         self.assertTemplateUsed(response, 'details.html')
-        self.assertIn(URL, response.content.decode())
         detailed_info_keys = ['name', 'subregion', 'region', 'capital', 'currencies',
-                           'destination_name', 'languages','population', 'wiki', 'photo']
+                           'destination_name', 'languages','population', 'wiki', 'photo_source']
         for key in detailed_info_keys:
             self.assertIn(key, response.context)
 
-    def test_detailed_page_view_invalid_destination(self):
-        """Test getting detailed informatio when the client
-        has only invalid destination in the dream destinations list."""
+    async def test_detailed_page_view_async_client(self):
+        """Test that the detailed page is served by the event loop of an ASGI worker."""
+        destination_list = await models.DreamDestinationsList.objects.acreate(owner = self.TEST_USER,
+                                                                            dream_destinations_list = 'Test List')
+        destination = await models.Destination.objects.acreate(destination_name = 'Amsterdam',
+                                                               country = 'Netherlands',
+                                                               list_name = destination_list)
+        client = AsyncClient()
+        await client.aforce_login(self.TEST_USER)
+        url = reverse(views.detailed_page) + f'?id={destination.pk}'
+        responses = await asyncio.gather(client.get(url), client.get(url))
+
+        for response in responses:
+            self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
+            self.assertEqual(response.context['capital'], 'Amsterdam')
+
+    def test_photo_view_not_loged_in(self):
+        """Test when the client is trying to get a background photo before logining in."""
+        response = self.client.get(reverse(views.photo_view))
+
+        self.assertEqual(response.status_code, self.REDIRECT_STATUS_CODE)
+
+    def test_photo_view_default(self):
+        """Test the background photo of the pages without a destination."""
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        response = self.client.get(reverse(views.photo_view))
+
+        # Here we expect that the places.py functions work correctly.
+        URL = 'https://lh3.googleusercontent.com/places/ANXAkqF8-HtmrqT45pxsKvU1eiKJxakzuXBgu6p1-XDeaOBxHF9tvUD1T-bcrwhME7hU-0nBh6pjLLerYHlgmk7cIOhPJC-iuz32kt0=s1600-w3024'
+        self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
+        self.assertEqual(response.json(), {'photo': URL})
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_photo_view_valid_destination(self):
+        """Test the background photo of a dream destination."""
+        destination_list = models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                                    dream_destinations_list = 'Test List')
+        destination = models.Destination.objects.create(destination_name = 'Amsterdam',
+                                                        country = 'Netherlands',
+                                                        list_name = destination_list)
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        response = self.client.get(reverse(views.photo_view) + f'?destination={destination.pk}')
+
+        URL = 'https://lh3.googleusercontent.com/places/ANXAkqFE6c9SV-XK_PtONP-tY-QPc5wxVDvnXXC4bR260GF-WRMBrmWICyUzhqoHSEq7mjuJ33CBu5Z30WIU5tpZC9Hb9iYwvG6q1IE=s1600-w4000'
+        self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
+        self.assertEqual(response.json(), {'photo': URL})
+
+    def test_photo_view_country(self):
+        """Test the background photo of the capital of a country."""
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        response = self.client.get(reverse(views.photo_view) + '?country=NL')
+
+        URL = 'https://lh3.googleusercontent.com/places/ANXAkqFE6c9SV-XK_PtONP-tY-QPc5wxVDvnXXC4bR260GF-WRMBrmWICyUzhqoHSEq7mjuJ33CBu5Z30WIU5tpZC9Hb9iYwvG6q1IE=s1600-w4000'
+        self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
+        self.assertEqual(response.json(), {'photo': URL})
+
+    def test_photo_view_is_cached(self):
+        """Test that the url of a background photo is requested from Google only once."""
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        first = self.client.get(reverse(views.photo_view))
+        with mock.patch.object(http_client, 'get_session', side_effect = AssertionError('Places was called')):
+            second = self.client.get(reverse(views.photo_view))
+
+        self.assertEqual(first.json(), second.json())
+
+    def test_photo_view_invalid_destination(self):
+        """Test the background photo of a destination unknown to Google Maps."""
         destination_list = models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
                                                                     dream_destinations_list = 'Test List')
         destination = models.Destination.objects.create(destination_name = 'Invalid Destination',
@@ -230,11 +338,101 @@ class TestViews(TestCase):
 
         self.client.login(username = self.TEST_USER.username,
                           password = self.PASSWORD)
-        url = reverse(views.detailed_page) + f'?id={destination.pk}'
-        response = self.client.get(url)
-        
+        response = self.client.get(reverse(views.photo_view) + f'?destination={destination.pk}')
+
+        self.assertEqual(response.status_code, self.NOT_FOUND_STATUS_CODE)
+
+    def test_photo_view_other_user_destination(self):
+        """Test that the destinations of the other users are not shown."""
+        other_user = User.objects.create_user(username = 'other_user', password = self.PASSWORD)
+        destination_list = models.DreamDestinationsList.objects.create(owner = other_user,
+                                                                    dream_destinations_list = 'Test List')
+        destination = models.Destination.objects.create(destination_name = 'Amsterdam',
+                                                        country = 'Netherlands',
+                                                        list_name = destination_list)
+
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        response = self.client.get(reverse(views.photo_view) + f'?destination={destination.pk}')
+
         self.assertEqual(response.status_code, self.NOT_FOUND_STATUS_CODE)
 
+    def test_photo_view_fresh_place(self):
+        """Test that the stored photo of a destination is returned without requesting Google."""
+        destination_list = models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                                    dream_destinations_list = 'Test List')
+        destination = models.Destination.objects.create(destination_name = 'Amsterdam',
+                                                        country = 'Netherlands',
+                                                        list_name = destination_list,
+                                                        place_id = 'amsterdam',
+                                                        photo_url = 'https://example.com/amsterdam.jpg',
+                                                        place_fetched_at = timezone.now())
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        with mock.patch.object(http_client, 'get_session', side_effect = AssertionError('Places was called')):
+            response = self.client.get(reverse(views.photo_view) + f'?destination={destination.pk}')
+
+        self.assertEqual(response.json(), {'photo': 'https://example.com/amsterdam.jpg'})
+
+    def test_photo_view_stale_place_is_refreshed(self):
+        """Test that the place of a destination is resolved again once it is stale."""
+        destination_list = models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                                    dream_destinations_list = 'Test List')
+        fetched_at = timezone.now() - timedelta(days = 8)
+        destination = models.Destination.objects.create(destination_name = 'Amsterdam',
+                                                        country = 'Netherlands',
+                                                        list_name = destination_list,
+                                                        place_id = 'amsterdam',
+                                                        photo_url = 'https://example.com/expired.jpg',
+                                                        place_fetched_at = fetched_at)
+        # The expired url is still in the photo cache, whose entries live longer than the destinations.
+        caching.get_cache().set(caching.make_key('photo', 'amsterdam_photo_reference', '4000'),
+                                'https://example.com/expired.jpg')
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        with override_settings(PLACES_DESTINATION_MAX_AGE = 60 * 60 * 24 * 7):
+            response = self.client.get(reverse(views.photo_view) + f'?destination={destination.pk}')
+
+        destination.refresh_from_db()
+        self.assertEqual(response.json(), {'photo': destination.photo_url})
+        self.assertTrue(destination.photo_url.startswith('https://lh3.googleusercontent.com/'))
+        self.assertEqual(destination.photo_reference, 'amsterdam_photo_reference')
+        self.assertGreater(destination.place_fetched_at, fetched_at)
+
+    def test_photo_view_unknown_place_is_not_requested_again(self):
+        """Test that a destination unknown to Google Maps is requested only until it is stale."""
+        destination_list = models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                                    dream_destinations_list = 'Test List')
+        destination = models.Destination.objects.create(destination_name = 'Invalid Destination',
+                                                        country = 'Bulgaria',
+                                                        list_name = destination_list)
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        url = reverse(views.photo_view) + f'?destination={destination.pk}'
+        first = self.client.get(url)
+        with mock.patch.object(http_client, 'get_session', side_effect = AssertionError('Places was called')):
+            second = self.client.get(url)
+
+        self.assertEqual(first.status_code, self.NOT_FOUND_STATUS_CODE)
+        self.assertEqual(second.status_code, self.NOT_FOUND_STATUS_CODE)
+        self.assertIsNotNone(models.Destination.objects.get(pk = destination.pk).place_fetched_at)
+
+    def test_photo_view_no_photo_destination(self):
+        """Test when the client has a valid dream 
+        destination in the list, but there is no photo for it."""
+        destination_list = models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                                    dream_destinations_list = 'Test List')
+        destination = models.Destination.objects.create(destination_name = 'Hungary',
+                                                        country = 'Hungary',
+                                                        list_name = destination_list)
+
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        response = self.client.get(reverse(views.photo_view) + f'?destination={destination.pk}')
+
+        self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
+        self.assertEqual(response.json(), {'photo': None})
+
     def test_detailed_page_view_no_photo_destination(self):
         """Test when the client has a valid dream 
         destination in the list, but there is no photo for it. 
@@ -252,7 +450,6 @@ class TestViews(TestCase):
 
         self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
         self.assertTemplateUsed(response, 'details.html')
-        self.assertNotIn('photo', response.context)
         detailed_info_keys = ['name', 'subregion', 'region', 'capital', 'currencies',
                            'destination_name', 'languages','population', 'wiki']
         for key in detailed_info_keys:
@@ -330,6 +527,983 @@ class TestViews(TestCase):
         self.assertEqual(response.status_code, self.REDIRECT_STATUS_CODE)
         self.assertTrue(models.Destination.objects.filter(destination_name = 'Amsterdam').exists())
 
+    def test_add_item_stores_canonical_country(self):
+        """Test that the country of a new destination is stored by its canonical name."""
+        models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                    dream_destinations_list = 'Test List')
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        url = reverse(views.add_item)
+        self.client.post(url, {'destination_name': 'Amsterdam', 'country': ' nld '})
+        self.client.post(url, {'destination_name': 'La Paz', 'country': 'bolivia'})
+
+        self.assertEqual(models.Destination.objects.get(destination_name = 'Amsterdam').country, 'Netherlands')
+        self.assertEqual(models.Destination.objects.get(destination_name = 'La Paz').country,
+                         pycountry.countries.get(alpha_2 = 'BO').name)
+
+    def test_add_item_prefetches_place(self):
+        """Test that the place of a new destination is resolved after it is added
+        and that its background photo is read from the database afterwards."""
+        models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                    dream_destinations_list = 'Test List')
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        with self.captureOnCommitCallbacks(execute = True) as callbacks:
+            self.client.post(reverse(views.add_item), {'destination_name': 'Amsterdam', 'country': 'Netherlands'})
+
+        destination = models.Destination.objects.get(destination_name = 'Amsterdam')
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(destination.place_id, 'ChIJVXealLU_xkcRja_At0z9AGY')
+        self.assertIsNotNone(destination.latitude)
+        self.assertIsNotNone(destination.longitude)
+        self.assertTrue(destination.photo_url.startswith('https://lh3.googleusercontent.com/'))
+
+        caching.get_cache().clear()
+        with mock.patch.object(http_client, 'get_session', side_effect = AssertionError('Places was called')):
+            response = self.client.get(reverse(views.photo_view) + f'?destination={destination.pk}')
+        self.assertEqual(response.json(), {'photo': destination.photo_url})
+
+    def test_add_item_prefetch_unknown_place(self):
+        """Test that a destination unknown to Google Maps is added without a place."""
+        models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                    dream_destinations_list = 'Test List')
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        with self.captureOnCommitCallbacks(execute = True):
+            response = self.client.post(reverse(views.add_item), {'destination_name': 'Invalid Destination',
+                                                                  'country': 'Bulgaria'})
+
+        destination = models.Destination.objects.get(destination_name = 'Invalid Destination')
+        self.assertEqual(response.status_code, self.REDIRECT_STATUS_CODE)
+        self.assertEqual(destination.place_id, '')
+        self.assertIsNone(destination.latitude)
+
+    @override_settings(PLACES_PREFETCH_INLINE = False)
+    def test_add_item_prefetch_in_background(self):
+        """Test that the place is resolved by the thread pool, after the response."""
+        models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                    dream_destinations_list = 'Test List')
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        with mock.patch.object(prefetch, 'get_executor') as get_executor:
+            with self.captureOnCommitCallbacks(execute = True):
+                self.client.post(reverse(views.add_item), {'destination_name': 'Amsterdam', 'country': 'Netherlands'})
+
+        destination = models.Destination.objects.get(destination_name = 'Amsterdam')
+        get_executor.return_value.submit.assert_called_once_with(prefetch._run, destination.pk)
+        self.assertEqual(destination.place_id, '')
+
+    def test_add_item_invalid_country(self):
+        """Test adding a destination in a country which doesn't exist."""
+        models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                    dream_destinations_list = 'Test List')
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        url = reverse(views.add_item)
+        response = self.client.post(url, {'destination_name': 'Atlantis', 'country': 'Atlantis'})
+
+        self.assertEqual(response.status_code, self.NOT_FOUND_STATUS_CODE)
+        self.assertFalse(models.Destination.objects.exists())
+
+    def test_register_populates_database(self):
+        """Test that the registration creates the lists of the user
+        in a few queries. The countries get their rows lazily."""
+        url = reverse(views.register)
+        fill_in_data = {'username': 'new_user', 'password1': 'burgas@01_usr',
+                        'password2': 'burgas@01_usr'}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, fill_in_data)
+
+        self.assertEqual(response.status_code, self.REDIRECT_STATUS_CODE)
+        user = User.objects.get(username = 'new_user')
+        self.assertTrue(models.DreamDestinationsList.objects.filter(owner = user).exists())
+        self.assertTrue(models.CountryList.objects.filter(owner = user).exists())
+        self.assertFalse(models.Country.objects.filter(countries_list__owner = user).exists())
+        self.assertLess(len(queries), 20)
+
+    def test_visit_item_by_code_creates_row(self):
+        """Test that touching a country from the catalogue creates the row of the user."""
+        curr_countries_list = models.CountryList.objects.create(owner = self.TEST_USER,
+                                                                countries_in_the_world = 'Test List')
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        url = reverse(views.visit_item_view) + '?code=NL&state=1'
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, self.SUCCESSFUL_STATUS_CODE)
+        self.assertEqual(response.json(), {'state': True})
+        country = models.Country.objects.get(countries_list = curr_countries_list)
+        self.assertEqual(country.name, 'Netherlands')
+        self.assertTrue(country.visited)
+
+        self.client.get(reverse(views.visit_item_view) + '?code=NL&state=0')
+        self.assertEqual(models.Country.objects.filter(countries_list = curr_countries_list).count(), 1)
+
+    def test_one_row_per_country_of_a_list(self):
+        """A country can't get a second row in the same list, e.g. from two quick first touches."""
+        countries_list = models.CountryList.objects.create(owner = self.TEST_USER,
+                                                           countries_in_the_world = 'Test List')
+        models.Country.objects.create(name = 'Netherlands', countries_list = countries_list)
+
+        with self.assertRaises(IntegrityError):
+            models.Country.objects.create(name = 'Netherlands', countries_list = countries_list)
+
+    def test_visit_item_invalid_code(self):
+        """Test touching a country code which is not in the catalogue."""
+        models.CountryList.objects.create(owner = self.TEST_USER, countries_in_the_world = 'Test List')
+        self.client.login(username = self.TEST_USER.username,
+                          password = self.PASSWORD)
+        url = reverse(views.visit_item_view) + '?code=XX&state=1'
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, self.NOT_FOUND_STATUS_CODE)
+
+
+class TestMetrics(PlacesStandInMixin, TestCase):
+    PASSWORD = 'pass1234'
+
+    def setUp(self):
+        caching.get_cache().clear()
+        metrics.reset()
+        self.TEST_USER = User.objects.create_user(username = 'test_user', password = self.PASSWORD)
+        models.DreamDestinationsList.objects.create(owner = self.TEST_USER,
+                                                    dream_destinations_list = 'Test List')
+        self.client.login(username = self.TEST_USER.username, password = self.PASSWORD)
+
+    @override_settings(DEBUG = True)
+    def test_headers_in_debug(self):
+        """Test that the queries and the outbound calls of a request are sent as headers."""
+        page = self.client.get(reverse(views.dream_destinations_view))
+        photo = self.client.get(reverse(views.photo_view))
+
+        self.assertEqual(page['X-SQL-Queries'], '4')
+        self.assertEqual(page['X-Outbound-Calls'], '0')
+        # The textsearch, the details and the photo redirect.
+        self.assertEqual(photo['X-Outbound-Calls'], '3')
+        self.assertIn('total;dur=', photo['Server-Timing'])
+
+    @override_settings(DEBUG = True)
+    async def test_headers_async_client(self):
+        """Test that the queries are counted when the request is served by the event loop."""
+        client = AsyncClient()
+        await client.aforce_login(self.TEST_USER)
+        response = await client.get(reverse(views.dream_destinations_view))
+
+        self.assertEqual(response['X-SQL-Queries'], '4')
+
+    def test_no_headers_without_debug(self):
+        response = self.client.get(reverse(views.dream_destinations_view))
+
+        self.assertNotIn('X-SQL-Queries', response)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_metrics_view(self):
+        """Test that the percentiles are aggregated per view and are shown only to the staff."""
+        for _ in range(3):
+            self.client.get(reverse(views.dream_destinations_view))
+        self.assertEqual(self.client.get(reverse(views.metrics_view)).status_code, 302)
+
+        self.TEST_USER.is_staff = True
+        self.TEST_USER.save()
+        summary = self.client.get(reverse(views.metrics_view)).json()
+
+        view_summary = summary['gui.views.dream_destinations_view']
+        self.assertEqual(view_summary['count'], 3)
+        self.assertEqual(view_summary['sql_queries'], {'p50': 4, 'p90': 4, 'p99': 4})
+        self.assertEqual(set(view_summary), {'count', 'total_ms', 'sql_queries', 'sql_ms',
+                                             'outbound_calls', 'outbound_ms'})
+
+    def test_percentile(self):
+        values = list(range(1, 11))
+        self.assertEqual(metrics.percentile(values, 50), 5)
+        self.assertEqual(metrics.percentile(values, 90), 9)
+        self.assertEqual(metrics.percentile(values, 99), 10)
+        self.assertEqual(metrics.percentile([7], 50), 7)
+
+
+class TestBenchmarks(TestCase):
+
+    def test_views_benchmark_command(self):
+        """Test that every page and action is measured and the results are JSON. The existing
+        users, the visit counters and the cache of the Places answers are left as they were."""
+        existing = User.objects.create_user(username = benchmarks.BENCHMARK_USERNAME)
+        caching.get_cache().clear()
+        output = StringIO()
+        call_command('benchmark', 'views', '--repeat', '1', stdout = output)
+        results = json.loads(output.getvalue())['views']
+
+        self.assertEqual(set(results), {'register', 'destination', 'dream_destinations', 'details', 'photo',
+                                        'add_item', 'remove_item', 'visit_item'})
+        self.assertEqual(results['dream_destinations']['queries'], 4)
+        self.assertEqual(list(User.objects.filter(username__startswith = 'benchmark')), [existing])
+        self.assertFalse(models.CountryVisits.objects.exists())
+        self.assertIsNone(caching.get_cache().get(caching.make_key('textsearch', 'Amsterdam, Netherlands', '', '')))
+
+    def test_most_visited_benchmark(self):
+        """Test that the generated visits are rolled back and the legacy query agrees with the counters."""
+        with mock.patch.object(benchmarks, 'MOST_VISITED_USERS', (30,)):
+            results = benchmarks.benchmark_most_visited(1)
+        benchmarks._create_visitors(30)
+
+        self.assertEqual(set(results[30]), {'legacy', 'current'})
+        self.assertEqual(models.Country.objects.count(), 30)
+        self.assertEqual(benchmarks._legacy_most_visited_country(),
+                         admin.CountryAdmin.find_most_visited_country())
+
+
+class TestCountryAdmin(TestCase):
+    PASSWORD = 'pass1234'
+
+    def setUp(self):
+        self.users_lists = []
+        for index in range(3):
+            user = User.objects.create_user(username = f'test_user_{index}', password = self.PASSWORD)
+            self.users_lists.append(models.CountryList.objects.create(owner = user))
+
+    def visit(self, countries_list, name, visited = True):
+        models.Country.objects.create(name = name, cities_to_visit = 30,
+                                      visited = visited, countries_list = countries_list)
+
+    def test_most_visited_country_single_query(self):
+        """The most visited country is read with one query from the counters."""
+        for countries_list in self.users_lists:
+            self.visit(countries_list, 'Netherlands')
+        self.visit(self.users_lists[0], 'Bulgaria')
+        self.visit(self.users_lists[1], 'Bulgaria', visited = False)
+        admin.CountryVisitsAdmin.rebuild()
+
+        with self.assertNumQueries(1):
+            most_visited = admin.CountryAdmin.find_most_visited_country()
+        self.assertEqual(most_visited, 'Netherlands')
+
+    def test_most_visited_country_tie_break(self):
+        """Ties are broken by the pycountry order of the countries."""
+        self.visit(self.users_lists[0], 'Netherlands')
+        self.visit(self.users_lists[1], 'Bulgaria')
+        admin.CountryVisitsAdmin.rebuild()
+        names = [country.name for country in pycountry.countries]
+        expected = min(['Netherlands', 'Bulgaria'], key = names.index)
+
+        self.assertEqual(admin.CountryAdmin.find_most_visited_country(), expected)
+
+    def test_most_visited_country_no_visits(self):
+        """Without any visits the first country in pycountry is returned."""
+        self.visit(self.users_lists[0], 'Netherlands', visited = False)
+
+        self.assertEqual(admin.CountryAdmin.find_most_visited_country(),
+                         list(pycountry.countries)[0].name)
+
+    def test_rebuild_visit_counts_command(self):
+        """The management command recounts the visits from the countries lists."""
+        self.visit(self.users_lists[0], 'Netherlands')
+        self.visit(self.users_lists[1], 'Netherlands')
+        self.visit(self.users_lists[2], 'Netherlands', visited = False)
+        models.CountryVisits.objects.create(name = 'Bulgaria', visits = 7)
+
+        call_command('rebuild_visit_counts', stdout = StringIO())
+
+        self.assertEqual(dict(models.CountryVisits.objects.values_list('name', 'visits')),
+                         {'Netherlands': 2})
+
+    def test_visit_item_updates_counter(self):
+        """Toggling the visited state of a country moves its counter only on a real change."""
+        user = User.objects.get(username = 'test_user_0')
+        self.visit(self.users_lists[0], 'Netherlands', visited = False)
+        country = models.Country.objects.get(name = 'Netherlands')
+        self.client.login(username = user.username, password = self.PASSWORD)
+        url = reverse(views.visit_item_view)
+
+        self.client.get(url + f'?id={country.pk}&state=1')
+        self.client.get(url + f'?id={country.pk}&state=1')
+        self.assertEqual(models.CountryVisits.objects.get(name = 'Netherlands').visits, 1)
+
+        response = self.client.get(url + f'?id={country.pk}&state=0')
+        self.assertEqual(response.json(), {'state': False})
+        self.assertEqual(models.CountryVisits.objects.get(name = 'Netherlands').visits, 0)
+
+    def test_deleted_user_is_not_counted(self):
+        """Deleting a user takes the visits of the countries in its list off the counters."""
+        self.visit(self.users_lists[0], 'Netherlands')
+        self.visit(self.users_lists[1], 'Netherlands')
+        self.visit(self.users_lists[1], 'Bulgaria', visited = False)
+        self.assertEqual(models.CountryVisits.objects.get(name = 'Netherlands').visits, 2)
+
+        User.objects.get(username = 'test_user_1').delete()
+
+        self.assertEqual(models.CountryVisits.objects.get(name = 'Netherlands').visits, 1)
+        self.assertFalse(models.CountryVisits.objects.filter(name = 'Bulgaria', visits__gt = 0).exists())
+
+    def test_edited_country_moves_counter(self):
+        """An edit of a row, e.g. in the admin site, moves the visit to the new name or state."""
+        self.visit(self.users_lists[0], 'Netherlands')
+        country = models.Country.objects.get(name = 'Netherlands')
+
+        country.name = 'Bulgaria'
+        country.save()
+        self.assertEqual(dict(models.CountryVisits.objects.values_list('name', 'visits')),
+                         {'Netherlands': 0, 'Bulgaria': 1})
+
+        country.visited = False
+        country.save()
+        self.assertEqual(models.CountryVisits.objects.get(name = 'Bulgaria').visits, 0)
+
+
+class TestCountriesCatalogue(TestCase):
+    PASSWORD = 'pass1234'
+
+    def test_merge_with_catalogue(self):
+        """The touched countries are rows of the user and the rest come from the catalogue."""
+        user = User.objects.create_user(username = 'test_user', password = self.PASSWORD)
+        countries_list = models.CountryList.objects.create(owner = user)
+        row = models.Country.objects.create(name = 'Netherlands', cities_to_visit = 30,
+                                            visited = True, countries_list = countries_list)
+
+        items = countries.merge_with_catalogue(countries_list.countries.all())
+
+        self.assertEqual([item.name for item in items], [country.name for country in pycountry.countries])
+        netherlands = next(item for item in items if item.name == 'Netherlands')
+        self.assertEqual(netherlands.pk, row.pk)
+        self.assertEqual(netherlands.code, 'NL')
+        united_states = next(item for item in items if item.name == 'United States')
+        self.assertIsNone(united_states.pk)
+        self.assertEqual(united_states.code, 'US')
+        self.assertEqual(united_states.cities_to_visit, 250)
+        self.assertFalse(united_states.visited)
+
+    def test_country_facts_are_memoized(self):
+        """A country is resolved once and then served from the facts store."""
+        countries.get_country_facts.cache_clear()
+
+        facts = countries.get_country_facts('Netherlands')
+        self.assertIs(countries.get_country_facts('Netherlands'), facts)
+        self.assertEqual((facts.capital, facts.alpha2, facts.alpha3), ('Amsterdam', 'NL', 'NLD'))
+        self.assertIn('EUR', facts.currencies)
+        stats = countries.get_facts_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_normalize_country_name(self):
+        """Names, official names, common names and codes resolve to the canonical name."""
+        bolivia = pycountry.countries.get(alpha_2 = 'BO')
+        for name in ['Netherlands', 'NETHERLANDS', 'nl', 'NLD', '528', 'Kingdom of the Netherlands']:
+            self.assertEqual(countries.normalize_country_name(name), 'Netherlands')
+        self.assertEqual(countries.normalize_country_name(bolivia.common_name), bolivia.name)
+        self.assertIsNone(countries.normalize_country_name('Atlantis'))
+        self.assertTrue(places.PlacesUtilities.is_country_valid('bolivia'))
+        self.assertFalse(places.PlacesUtilities.is_country_valid('Atlantis'))
+
+    def test_country_facts_unknown_country(self):
+        with self.assertRaises(LookupError):
+            countries.get_country_facts('Atlantis')
+
+class TestPlacesCache(TestCase):
+    RESPONSE = {'status': 'OK', 'results': [{'place_id': 'amsterdam_id', 'name': 'Amsterdam',
+                                             'geometry': {'location': {'lat': 52.37, 'lng': 4.9}}}]}
+
+    def setUp(self):
+        caching.get_cache().clear()
+
+    def mock_get(self, response):
+        patcher = mock.patch.object(http_client, 'get_session')
+        session = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        session.get.return_value.status_code = 200
+        session.get.return_value.json.return_value = response
+        return session.get
+
+    def test_text_search_is_cached(self):
+        """A repeated query is answered from the cache."""
+        get = self.mock_get(self.RESPONSE)
+
+        first = places.PlacesUtilities.find_places_given_place_type_and_radius('Amsterdam')
+        second = places.PlacesUtilities.find_places_given_place_type_and_radius('Amsterdam')
+
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(first[0].place_id, second[0].place_id)
+
+    def test_text_search_key_includes_type(self):
+        """Queries with different types of places are cached separately."""
+        get = self.mock_get(self.RESPONSE)
+
+        places.PlacesUtilities.find_places_given_place_type_and_radius('Amsterdam')
+        places.PlacesUtilities.find_places_given_place_type_and_radius('Amsterdam', type = 'museum')
+
+        self.assertEqual(get.call_count, 2)
+
+    def test_text_search_errors_are_not_cached(self):
+        """Responses with an error status are requested again."""
+        get = self.mock_get({'status': 'REQUEST_DENIED', 'results': []})
+
+        for _ in range(2):
+            with self.assertRaises(IndexError):
+                places.PlacesUtilities.find_places_given_place_type_and_radius('Amsterdam')
+
+        self.assertEqual(get.call_count, 2)
+
+    @override_settings(PLACES_CACHE_TTL = {'textsearch': 0})
+    def test_text_search_ttl(self):
+        """Entries older than their time to live are requested again."""
+        get = self.mock_get(self.RESPONSE)
+
+        places.PlacesUtilities.find_places_given_place_type_and_radius('Amsterdam')
+        places.PlacesUtilities.find_places_given_place_type_and_radius('Amsterdam')
+
+        self.assertEqual(get.call_count, 2)
+
+    def test_photo_url_is_resolved_from_redirect(self):
+        """The photo url is read from the redirect without downloading the image and is cached."""
+        photo_url = 'https://lh3.googleusercontent.com/places/photo=s1600-w4000'
+        get = self.mock_get({})
+        get.return_value.headers = {'Location': photo_url}
+        place = places.Place('amsterdam_id', (52.37, 4.9), 'Amsterdam', False)
+        place.photo_reference = 'amsterdam_photo'
+
+        self.assertEqual(place.get_photo_url(), photo_url)
+        self.assertEqual(place.get_photo_url(), photo_url)
+        self.assertEqual(get.call_count, 1)
+        self.assertFalse(get.call_args.kwargs['allow_redirects'])
+
+    def test_photo_url_expires_with_the_destinations(self):
+        """The background photos of the countries don't outlive the photos of the destinations."""
+        self.assertLessEqual(settings.PLACES_CACHE_TTL['photo'], settings.PLACES_DESTINATION_MAX_AGE)
+
+    def test_photo_url_without_redirect(self):
+        """A photo which doesn't redirect to an image has no url and is not cached."""
+        get = self.mock_get({})
+        get.return_value.headers = {}
+        place = places.Place('amsterdam_id', (52.37, 4.9), 'Amsterdam', False)
+        place.photo_reference = 'amsterdam_photo'
+
+        for _ in range(2):
+            with self.assertRaises(KeyError):
+                place.get_photo_url()
+        self.assertEqual(get.call_count, 2)
+
+@override_settings(PLACES_HTTP_BACKOFF_FACTOR = 0)
+class TestHttpClient(TestCase):
+
+    def setUp(self):
+        http_client.reset_stats()
+        self.session = self.mock_session()
+
+    def mock_session(self):
+        patcher = mock.patch.object(http_client, 'get_session')
+        self.addCleanup(patcher.stop)
+        return patcher.start().return_value
+
+    def response(self, data, status_code = 200):
+        response = mock.Mock(status_code = status_code)
+        response.json.return_value = data
+        return response
+
+    def test_get_has_timeouts(self):
+        """Every request is sent with connect and read timeouts."""
+        self.session.get.return_value = self.response({'status': 'OK'})
+
+        http_client.get('details', 'https://example.com')
+
+        self.assertEqual(self.session.get.call_args.kwargs['timeout'], (3.05, 10))
+
+    def test_get_json_retries_over_query_limit(self):
+        """OVER_QUERY_LIMIT answers are retried, until the retries run out."""
+        self.session.get.side_effect = [self.response({'status': 'OVER_QUERY_LIMIT'}),
+                                        self.response({'status': 'OK'})]
+
+        self.assertEqual(http_client.get_json('details', 'https://example.com'), {'status': 'OK'})
+
+        self.session.get.side_effect = None
+        self.session.get.return_value = self.response({'status': 'OVER_QUERY_LIMIT'})
+        data = http_client.get_json('details', 'https://example.com')
+        self.assertEqual(data['status'], 'OVER_QUERY_LIMIT')
+        self.assertEqual(self.session.get.call_count, 2 + 3)
+
+    def test_stats_per_endpoint(self):
+        """The calls and the errors are counted per endpoint."""
+        self.session.get.return_value = self.response({}, status_code = 500)
+        http_client.get('photo', 'https://example.com')
+        self.session.get.return_value = self.response({})
+        http_client.get('photo', 'https://example.com')
+        http_client.get('details', 'https://example.com')
+
+        stats = http_client.get_stats()
+        self.assertEqual(stats['photo']['count'], 2)
+        self.assertEqual(stats['photo']['errors'], 1)
+        self.assertEqual(stats['details']['count'], 1)
+
+    def test_session_is_shared(self):
+        """All of the calls use one pooled session, which retries the 5xx responses."""
+        mock.patch.stopall()
+        self.addCleanup(setattr, http_client, '_session', None)
+        http_client._session = None
+
+        session = http_client.get_session()
+
+        self.assertIs(http_client.get_session(), session)
+        retry = session.get_adapter('https://maps.googleapis.com').max_retries
+        self.assertEqual(retry.total, 2)
+        self.assertIn(503, retry.status_forcelist)
+
+class TestFakePlaces(PlacesStandInMixin, TestCase):
+
+    def setUp(self):
+        caching.get_cache().clear()
+
+    def test_recorded_place(self):
+        """The stand-in replays the recorded textsearch, details and photo responses."""
+        place = places.PlacesUtilities.find_places_given_place_type_and_radius('Amsterdam')[0]
+
+        self.assertEqual(place.name, 'Amsterdam')
+        self.assertEqual(place.get_photo_reference(), 'amsterdam_photo_reference')
+        self.assertTrue(place.get_photo_url().startswith('https://lh3.googleusercontent.com/'))
+
+    def test_unknown_place(self):
+        """Queries which are not recorded have no results."""
+        with self.assertRaises(IndexError):
+            places.PlacesUtilities.find_places_given_place_type_and_radius('Nowhere, Atlantis')
+
+class TestPlacesUtilities(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.utilities = places.PlacesUtilities()
+
+    def test_biggest_cities_match_full_scan(self):
+        """The city index gives the same cities as a scan of all cities."""
+        for country_name in ['Netherlands', 'United States']:
+            self.assertEqual(self.utilities.find_biggest_cities_by_country_name(country_name),
+                             benchmarks._legacy_biggest_cities(self.utilities, country_name))
+
+    def test_biggest_cities_limits(self):
+        """Top 30 cities per country, top 5 cities per state for the USA."""
+        self.assertEqual(len(self.utilities.find_biggest_cities_by_country_name('Bulgaria')), 30)
+        usa_cities = self.utilities.find_biggest_cities_by_country_name('United States')
+        self.assertLessEqual(len(usa_cities), 5 * len(self.utilities.geonames.get_us_states()))
+        self.assertEqual(usa_cities[0], 'New York City')
+
+    def test_resources_are_shared(self):
+        """The geonames cache and the geolocator are loaded once per process."""
+        other = places.PlacesUtilities()
+
+        self.assertIs(other.geonames, self.utilities.geonames)
+        self.assertIs(other.geolocator, self.utilities.geolocator)
+        self.assertIs(places.get_geonames(), self.utilities.geonames)
+
+    def test_biggest_cities_invalid_country(self):
+        self.assertEqual(self.utilities.find_biggest_cities_by_country_name('Atlantis'), [])
+
+    def test_biggest_cities_without_country_facts(self):
+        """The cities are found by the country code alone, the facts about the country aren't needed."""
+        with mock.patch.object(countries, 'get_country_facts', side_effect = LookupError('Bulgaria')):
+            self.assertEqual(len(self.utilities.find_biggest_cities_by_country_name('Bulgaria')), 30)
+
+    def test_coordinates_offline(self):
+        """The countries and the cities are resolved from the country table, without Nominatim."""
+        with mock.patch.object(places, 'get_geolocator', side_effect = AssertionError('Nominatim was called')):
+            self.assertEqual(self.utilities.get_longitude_latitude_tuple('Netherlands'), (52.5, 5.75))
+            self.assertEqual(self.utilities.get_longitude_latitude_tuple('amsterdam'), (52.37403, 4.88969))
+            self.assertEqual(self.utilities.get_longitude_latitude_tuple('Amsterdam, United States'),
+                             (42.93869, -74.18819))
+
+    def test_coordinates_offline_ignore_country_codes(self):
+        """A country code isn't a place, e.g. Sur is a city in Oman and not SUR, Suriname."""
+        self.assertEqual(places.find_coordinates_offline('Sur'), (22.56667, 59.52889))
+        self.assertIsNone(places.find_coordinates_offline('100'))
+
+    def test_coordinates_are_geocoded_and_cached(self):
+        """The other strings are geocoded by Nominatim once."""
+        caching.get_cache().clear()
+        geolocator = mock.Mock()
+        geolocator.geocode.return_value = mock.Mock(latitude = 52.36, longitude = 4.88)
+        with mock.patch.object(places, 'get_geolocator', return_value = geolocator):
+            self.assertEqual(self.utilities.get_longitude_latitude_tuple('Rijksmuseum, Amsterdam'), (52.36, 4.88))
+            self.assertEqual(self.utilities.get_longitude_latitude_tuple('Rijksmuseum, Amsterdam'), (52.36, 4.88))
+
+        geolocator.geocode.assert_called_once_with('Rijksmuseum, Amsterdam')
+
+    def test_coordinates_unknown_place(self):
+        """An unknown place raises AttributeError and is geocoded again next time."""
+        caching.get_cache().clear()
+        geolocator = mock.Mock()
+        geolocator.geocode.return_value = None
+        with mock.patch.object(places, 'get_geolocator', return_value = geolocator):
+            for _ in range(2):
+                with self.assertRaises(AttributeError):
+                    self.utilities.get_longitude_latitude_tuple('Atlantis, Ocean')
+
+        self.assertEqual(geolocator.geocode.call_count, 2)
+
+class TestRateLimit(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'rate_limit.sqlite3')
+        settings_override = override_settings(PLACES_RATE_LIMIT_PATH = self.path, PLACES_RATE_LIMIT_TIMEOUT = 0,
+                                              PLACES_RATE_LIMITS = {'test': (0.1, 2)})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(rate_limit.close)
+
+    def test_burst_then_deadline(self):
+        """The calls of a full bucket pass at once, then a call fails if its token comes after the deadline."""
+        rate_limit.acquire('test')
+        rate_limit.acquire('test')
+        with self.assertRaises(rate_limit.RateLimitExceeded):
+            rate_limit.acquire('test')
+
+    def test_waits_for_the_next_token(self):
+        """A call waits for the next token when it comes before the deadline."""
+        rate_limit.acquire('test')
+        rate_limit.acquire('test')
+        with mock.patch.object(rate_limit.time, 'sleep') as sleep:
+            sleep.side_effect = lambda seconds: self.assertAlmostEqual(seconds, 10, delta = 0.1)
+            with mock.patch.object(rate_limit, '_take', side_effect = [10, 0]):
+                rate_limit.acquire('test', timeout = 20)
+
+        sleep.assert_called_once()
+
+    def test_time_is_read_under_the_lock(self):
+        """A call which waited for the lock doesn't write back the time from before it waited."""
+        events = []
+        connection = rate_limit.get_connection()
+
+        class RecordingConnection:
+            def execute(self, sql, *args):
+                if sql.startswith('BEGIN'):
+                    events.append('lock')
+                return connection.execute(sql, *args)
+
+        with mock.patch.object(rate_limit, 'get_connection', return_value = RecordingConnection()), \
+             mock.patch.object(rate_limit.time, 'time', side_effect = lambda: events.append('time') or 1000.0):
+            rate_limit._take('test', 0.1, 2)
+
+        self.assertEqual(events, ['lock', 'time'])
+
+    def test_clock_behind_the_bucket(self):
+        """A time before the last update of the bucket credits no tokens."""
+        with mock.patch.object(rate_limit.time, 'time', return_value = 1000.0):
+            rate_limit.acquire('test')
+            rate_limit.acquire('test')
+        with mock.patch.object(rate_limit.time, 'time', return_value = 990.0):
+            with self.assertRaises(rate_limit.RateLimitExceeded):
+                rate_limit.acquire('test')
+
+    def test_shared_between_connections(self):
+        """The budget is shared by the processes, which have their own connections to the file."""
+        rate_limit.acquire('test')
+        rate_limit.close()
+        rate_limit.acquire('test')
+        rate_limit.close()
+        with self.assertRaises(rate_limit.RateLimitExceeded):
+            rate_limit.acquire('test')
+
+    def test_endpoint_without_budget(self):
+        for _ in range(10):
+            rate_limit.acquire('unlimited')
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_http_client_spends_the_budget(self):
+        """Every request through the shared session takes a token of its endpoint."""
+        with override_settings(PLACES_RATE_LIMITS = {'photo': (0.1, 1)}), \
+             mock.patch.object(http_client, 'get_session') as get_session:
+            get_session.return_value.get.return_value.status_code = 302
+            http_client.get('photo', 'https://example.com')
+            with self.assertRaises(rate_limit.RateLimitExceeded):
+                http_client.get('photo', 'https://example.com')
+
+        self.assertEqual(get_session.return_value.get.call_count, 1)
+
+
+class TestPlacesPagination(PlacesStandInMixin, TestCase):
+    MUSEUMS = 45
+
+    def setUp(self):
+        caching.get_cache().clear()
+        http_client.reset_stats()
+
+    def textsearch_requests(self):
+        return http_client.get_stats().get('textsearch', {}).get('count', 0)
+
+    def test_follows_every_page(self):
+        """All of the pages of a textsearch are yielded, in their order."""
+        museums = list(places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam', type = 'museum'))
+
+        self.assertEqual(len(museums), self.MUSEUMS)
+        self.assertEqual([museum.place_id for museum in museums],
+                         [f'amsterdam_museum_{index}' for index in range(1, self.MUSEUMS + 1)])
+        self.assertTrue(all(museum.is_attraction for museum in museums))
+        self.assertEqual(self.textsearch_requests(), 3)
+
+    def test_places_are_yielded_as_pages_arrive(self):
+        """The next page is requested only when the places of the previous one are used."""
+        museums = places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam', type = 'museum')
+
+        self.assertEqual(next(museums).name, 'Rijksmuseum')
+        self.assertEqual(self.textsearch_requests(), 1)
+
+    def test_max_results(self):
+        museums = list(places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam', type = 'museum',
+                                                                                      max_results = 25))
+
+        self.assertEqual(len(museums), 25)
+        self.assertEqual(self.textsearch_requests(), 2)
+
+    def test_pages_are_cached(self):
+        list(places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam', type = 'museum'))
+        with mock.patch.object(places.time, 'sleep') as sleep:
+            museums = list(places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam',
+                                                                                          type = 'museum'))
+
+        self.assertEqual(len(museums), self.MUSEUMS)
+        self.assertEqual(self.textsearch_requests(), 3)
+        sleep.assert_not_called()
+
+    @override_settings(PLACES_PAGE_TOKEN_DELAY = 2)
+    def test_page_token_delay(self):
+        """The token of a next page is used after the delay required by Google."""
+        with mock.patch.object(places.time, 'sleep') as sleep:
+            list(places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam', type = 'museum'))
+
+        self.assertEqual(sleep.call_args_list, [mock.call(2), mock.call(2)])
+
+    def test_expired_page_token(self):
+        """The search ends with the last valid page when a page token is rejected."""
+        first_page = {'status': 'OK', 'next_page_token': 'expired_token',
+                      'results': [{'place_id': 'museum', 'name': 'Museum',
+                                   'geometry': {'location': {'lat': 52.36, 'lng': 4.88}}}]}
+        with mock.patch.object(places.PlacesUtilities, 'text_search', return_value = first_page):
+            museums = list(places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam',
+                                                                                          type = 'museum'))
+
+        self.assertEqual([museum.place_id for museum in museums], ['museum'])
+        self.assertEqual(self.textsearch_requests(), places.PAGE_TOKEN_ATTEMPTS)
+
+    def test_without_type(self):
+        """Without a type only the place itself is yielded."""
+        found = list(places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam'))
+
+        self.assertEqual([place.name for place in found], ['Amsterdam'])
+
+
+class TestPlacesHydration(PlacesStandInMixin, TestCase):
+
+    def setUp(self):
+        caching.get_cache().clear()
+        http_client.reset_stats()
+
+    def details_requests(self):
+        return http_client.get_stats().get('details', {}).get('count', 0)
+
+    def museums(self):
+        return list(places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam', type = 'museum'))
+
+    def test_hydrate(self):
+        """The details of every place are set, also of the places without photos."""
+        museums = places.PlacesUtilities.hydrate(self.museums())
+
+        self.assertTrue(all(museum.has_details() for museum in museums))
+        self.assertEqual(museums[0].get_rating_tuple(), (3.6, 12))
+        self.assertEqual(museums[0].get_photo_reference(), 'amsterdam_museum_1_photo_reference')
+        # Every tenth museum of the recordings has no photos.
+        with self.assertRaises(KeyError):
+            museums[9].get_photo_reference()
+        self.assertEqual(self.details_requests(), len(museums))
+
+    def test_hydrate_dedupes_place_ids(self):
+        museums = self.museums()
+        duplicates = [places.Place(museum.place_id, (museum.latitude, museum.longitude), museum.name, True)
+                      for museum in museums[:5]]
+        places.PlacesUtilities.hydrate(museums + duplicates)
+
+        self.assertEqual(self.details_requests(), len(museums))
+        self.assertEqual(duplicates[0].get_rating_tuple(), museums[0].get_rating_tuple())
+
+    def test_hydrate_reuses_cached_details(self):
+        places.PlacesUtilities.hydrate(self.museums())
+        http_client.reset_stats()
+        museums = places.PlacesUtilities.hydrate(self.museums())
+
+        self.assertEqual(self.details_requests(), 0)
+        self.assertTrue(all(museum.has_details() for museum in museums))
+
+    def test_hydrate_skips_places_with_details(self):
+        museums = self.museums()[:3]
+        museums[0].set_details()
+        http_client.reset_stats()
+        places.PlacesUtilities.hydrate(museums)
+
+        self.assertEqual(self.details_requests(), 2)
+
+    def test_hydrate_unknown_place(self):
+        """A place without details is left as it is."""
+        unknown = places.Place('unknown_place_id', (0, 0), 'Unknown', True)
+        places.PlacesUtilities.hydrate([unknown])
+
+        self.assertFalse(unknown.has_details())
+
+    def test_hydrate_is_concurrent(self):
+        """The details are requested by a bounded number of threads at a time."""
+        server = fake_places.FakePlacesServer(delay = 0.1).start()
+        self.addCleanup(server.stop)
+        museums = self.museums()[:16]
+        with override_settings(PLACES_API_BASE_URL = server.url), \
+             mock.patch.object(places, 'ThreadPoolExecutor', wraps = places.ThreadPoolExecutor) as executor:
+            start = time.perf_counter()
+            places.PlacesUtilities.hydrate(museums, max_workers = 8)
+            elapsed = time.perf_counter() - start
+
+        executor.assert_called_once_with(max_workers = 8)
+        # One after another the requests would take 16 * 0.1 seconds.
+        self.assertLess(elapsed, 1.0)
+        self.assertTrue(all(museum.has_details() for museum in museums))
+
+
+class TestRanking(PlacesStandInMixin, TestCase):
+
+    def setUp(self):
+        caching.get_cache().clear()
+        http_client.reset_stats()
+
+    def rated_place(self, place_id, rating, user_ratings_total):
+        place = places.Place(place_id, (0, 0), place_id, True)
+        place.set_details({'result': {'formatted_address': place_id, 'types': [], 'rating': rating,
+                                      'user_ratings_total': user_ratings_total,
+                                      'photos': [{'photo_reference': place_id}]}})
+        return place
+
+    @override_settings(PLACES_RANKING_PRIOR_RATING = 3.5, PLACES_RANKING_PRIOR_WEIGHT = 100)
+    def test_bayesian_average(self):
+        self.assertEqual(ranking.bayesian_average(5, 0), 3.5)
+        self.assertEqual(ranking.bayesian_average(5, 100), 4.25)
+        self.assertAlmostEqual(ranking.bayesian_average(4.5, 10 ** 6), 4.5, places = 3)
+
+    def test_unrated_place(self):
+        """A place without ratings gets the rating 0 out of 0, without any output."""
+        place = places.Place('unrated', (0, 0), 'unrated', True)
+        with mock.patch('sys.stdout', new_callable = StringIO) as stdout:
+            place.set_details({'result': {'formatted_address': 'unrated', 'types': [],
+                                          'photos': [{'photo_reference': 'unrated'}]}})
+
+        self.assertEqual(place.get_rating_tuple(), (0, 0))
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_few_ratings_are_weighted_less(self):
+        """A perfect rating out of a few reviews ranks below a high rating out of many."""
+        candidates = [self.rated_place('few', 5, 3), self.rated_place('many', 4.7, 30000),
+                      self.rated_place('unrated', 0, 0)]
+
+        self.assertEqual([place.place_id for place in ranking.rank_places(candidates, 3)], ['many', 'few'])
+
+    def test_ties_keep_the_order_of_google(self):
+        candidates = [self.rated_place(place_id, 4, 50) for place_id in ('first', 'second', 'third')]
+
+        self.assertEqual([place.place_id for place in ranking.rank_places(candidates, 2)], ['first', 'second'])
+
+    def test_top_attractions(self):
+        """The top k are the best k of all of the pages, by their Bayesian average."""
+        top = ranking.find_top_attractions('Amsterdam', 'museum', k = 5)
+
+        museums = places.PlacesUtilities.hydrate(
+            list(places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam', type = 'museum')))
+        expected = sorted(museums, key = lambda museum: ranking.bayesian_average(*museum.get_rating_tuple()),
+                          reverse = True)[:5]
+        self.assertEqual([museum.place_id for museum in top], [museum.place_id for museum in expected])
+
+    def test_top_attractions_are_cached(self):
+        first = ranking.find_top_attractions('Amsterdam', 'museum', k = 5)
+        http_client.reset_stats()
+        with mock.patch.object(http_client, 'get_session', side_effect = AssertionError('Places was called')):
+            second = ranking.find_top_attractions('Amsterdam', 'museum', k = 5)
+
+        self.assertEqual([museum.place_id for museum in first], [museum.place_id for museum in second])
+        self.assertEqual(second[0].get_rating_tuple(), first[0].get_rating_tuple())
+
+    def test_failed_search_is_not_cached(self):
+        """An empty ranking because of an error of the textsearch is requested again."""
+        denied = {'status': 'REQUEST_DENIED', 'results': []}
+        with mock.patch.object(places.PlacesUtilities, 'text_search', return_value = denied):
+            self.assertEqual(ranking.find_top_attractions('Amsterdam', 'museum', k = 5), [])
+
+        self.assertIsNone(caching.get_cache().get(caching.make_key('ranking', 'Amsterdam', 'museum', 5)))
+        self.assertEqual(len(ranking.find_top_attractions('Amsterdam', 'museum', k = 5)), 5)
+
+    def test_partial_ranking_is_not_cached(self):
+        """A ranking which misses the details of a place is requested again."""
+        museums = list(places.PlacesUtilities.iter_places_given_place_type_and_radius('Amsterdam', type = 'museum'))
+        failing_place_id = museums[0].place_id
+        get_place_details = places.get_place_details
+
+        def details_or_error(place_id):
+            if place_id == failing_place_id:
+                raise rate_limit.RateLimitExceeded('details')
+            return get_place_details(place_id)
+
+        with mock.patch.object(places, 'get_place_details', side_effect = details_or_error):
+            partial = ranking.find_top_attractions('Amsterdam', 'museum', k = 45)
+
+        self.assertNotIn(failing_place_id, [museum.place_id for museum in partial])
+        self.assertIsNone(caching.get_cache().get(caching.make_key('ranking', 'Amsterdam', 'museum', 45)))
+        complete = ranking.find_top_attractions('Amsterdam', 'museum', k = 45)
+        self.assertIn(failing_place_id, [museum.place_id for museum in complete])
+
+    def test_details_are_requested_in_batches(self):
+        with mock.patch.object(places.PlacesUtilities, 'hydrate',
+                               wraps = places.PlacesUtilities.hydrate) as hydrate:
+            ranking.find_top_attractions('Amsterdam', 'museum', k = 5)
+
+        self.assertEqual([len(call.args[0]) for call in hydrate.call_args_list], [20, 20, 5])
+
+    def test_no_attractions(self):
+        self.assertEqual(ranking.find_top_attractions('Atlantis', 'museum'), [])
+
+
+class TestCountryTable(TestCase):
+
+    def test_build_country_table(self):
+        """The generated table has every country and the biggest cities of every country."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'countries.sqlite3')
+            call_command('build_country_table', output = path, stdout = StringIO())
+            connection = sqlite3.connect(path)
+            self.addCleanup(connection.close)
+
+            self.assertEqual(connection.execute("SELECT COUNT(*) FROM countries").fetchone()[0],
+                             len(pycountry.countries))
+            self.assertEqual(connection.execute("SELECT capital FROM countries WHERE alpha2 = 'NL'").fetchone()[0],
+                             'Amsterdam')
+            self.assertEqual(connection.execute("SELECT COUNT(*) FROM biggest_cities WHERE country_code = 'BG'")
+                             .fetchone()[0], 30)
+
+    def test_outdated_table_is_rebuilt(self):
+        """A table with an old schema version is rebuilt on first use."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'countries.sqlite3')
+            sqlite3.connect(path).close()
+            with override_settings(COUNTRY_TABLE_PATH = path):
+                self.addCleanup(country_table.close)
+                rows = country_table.query("SELECT name FROM countries WHERE alpha2 = 'BG'")
+
+        self.assertEqual(rows[0]['name'], 'Bulgaria')
+
+    def test_table_of_other_library_versions_is_outdated(self):
+        """An upgrade of pycountry, countryinfo or geonamescache rebuilds the table."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'countries.sqlite3')
+            country_table.build(path)
+            self.assertTrue(country_table._is_current(path))
+            versions = {**country_table.get_library_versions(), 'pycountry': '0.0'}
+            with mock.patch.object(country_table, 'get_library_versions', return_value = versions):
+                self.assertFalse(country_table._is_current(path))
+
+    def test_table_built_by_another_process_is_not_built_again(self):
+        """A process which waited for the lock of the build reads the table built meanwhile."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'countries.sqlite3')
+            with mock.patch.object(country_table, '_is_current', side_effect = [False, True]), \
+                 mock.patch.object(country_table, 'build') as build:
+                country_table._build_if_outdated(path)
+
+        build.assert_not_called()
 
 class TestForms(TestCase):
     DEST_NAME_STR = 'Amsterdam'
@@ -555,4 +1729,12 @@ class TestUrls(TestCase):
 
     def test_logout_url(self):
         url = reverse(views.logout_view)
-        self.assertEqual(resolve(url).func, views.logout_view)
\ No newline at end of file
+        self.assertEqual(resolve(url).func, views.logout_view)
+
+    def test_photo_url(self):
+        url = reverse(views.photo_view)
+        self.assertEqual(resolve(url).func, views.photo_view)
+
+    def test_metrics_url(self):
+        url = reverse(views.metrics_view)
+        self.assertEqual(resolve(url).func, views.metrics_view)
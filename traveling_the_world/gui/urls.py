@@ -9,9 +9,11 @@ urlpatterns = [
     path('dream_destinations/', views.dream_destinations_view), # Add url for the dream destinations page.
     path('destination/', views.find_destination_view), # Add url for the destinations page.
     path('dream_destinations/details/', views.detailed_page), # Add detailed page for each dream destination.
+    path('photo/', views.photo_view), # Url of the background photo of a page.
     path('remove_item/', views.remove_item), # Remove an item from the dream_destination list.
     path('dream_destinations/add_item/', views.add_item),
     path('register/', views.register), # Add registration url.
     path('visit_item/', views.visit_item_view),
     path('logout/', views.logout_view), # Add logout url.
+    path('metrics/', views.metrics_view), # Latency and queries per view, for the staff.
 ]
@@ -1,16 +1,25 @@
+import asyncio
 import random
-import countryinfo
 
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import logout
 from django.contrib.auth import login
+from django.db import transaction
 from django.http import HttpResponseNotFound, JsonResponse
+from django.utils.cache import patch_cache_control
 from .forms import AddDestinationForm, RegisterUserForm
 
 from .places import PlacesUtilities
 from . import models
 from . import admin
+from . import countries
+from . import prefetch
+from . import metrics
+
+# Seconds for which the browsers may reuse the url of a background photo.
+PHOTO_MAX_AGE = 60 * 60
 
 @login_required(login_url='/login/')
 def home_page(request):
@@ -20,95 +29,124 @@ def home_page(request):
     }
     return render(request, 'home_page.html', context)
 
+def get_dream_destinations(user):
+    """Return the name and the items of the list with dream destinations
+    of the user, and a random destination of them (None for an empty list)."""
+    # One query for the list and one for its items. The page renders all of the items,
+    # so the random destination is picked from them instead of by another query.
+    destination_list = models.DreamDestinationsList.objects.prefetch_related('items').get(owner=user)
+    items = list(destination_list.items.all())
+    destination = random.choice(items) if items else None
+    return destination_list.dream_destinations_list, items, destination
+
 @login_required(login_url='/login/')
-def dream_destinations_view(request):
+async def dream_destinations_view(request):
     """Dream destinations page."""
     try:
-        destination_list = models.DreamDestinationsList.objects.filter(owner=request.user)
-        length = len(destination_list.get().items.all())
+        name, items, destination = await sync_to_async(get_dream_destinations)(await request.auser())
     except (KeyError, models.DreamDestinationsList.DoesNotExist):
         return HttpResponseNotFound('Invalid link. No dream destinations.')
 
-    if not length:
-        # Show background image of Burgas, if the list of dream destinations is empty.
-        place_obj = PlacesUtilities.find_places_given_place_type_and_radius('Burgas, Bridge')
-    else:
-        # Select random destination from the list and verify does it exist.
-        index = random.randint(1, len(destination_list.get().items.all()))
-        destination = destination_list.get().items.all()[index - 1]
-        try:
-            place_obj = PlacesUtilities.find_places_given_place_type_and_radius(destination)
-        except:
-            return HttpResponseNotFound(f"'{destination}' is invalid or there is lack of information about it.")
-
     context = {
-        'name': destination_list.values().get()['dream_destinations_list'],
-        'items': destination_list.get().items.all(),
+        'name': name,
+        'items': items,
     }
-    try:
-        picture = place_obj[0].get_photo_url()
-        context['photo'] = picture
-    except KeyError:
-        # There will be no background picture.
-        pass
+    if destination is None:
+        # Show background image of Burgas, if the list of dream destinations is empty.
+        context['photo_source'] = '/photo/'
+    else:
+        # Show background image of a random destination from the list.
+        context['photo_source'] = f'/photo/?destination={destination.pk}'
 
     return render(request, 'dream_list.html', context)
 
+def get_countries_items(user):
+    """Return every country in the world for the user and the most visited country."""
+    countries_list = models.CountryList.objects.filter(owner=user)
+    # Only the touched countries have rows, the rest come from the shared catalogue.
+    countries_items = countries.merge_with_catalogue(countries_list.get().countries.all())
+    return countries_items, admin.CountryAdmin.find_most_visited_country()
+
 @login_required(login_url='/login/')
-def find_destination_view(request):
+async def find_destination_view(request):
     """View for the Destination tab."""
     try:
-        countries_list = models.CountryList.objects.filter(owner=request.user)
-        countries_items = countries_list.get().countries.all()
+        countries_items, most_visited_country = await sync_to_async(get_countries_items)(await request.auser())
     except (KeyError, models.CountryList.DoesNotExist):
         return HttpResponseNotFound('Invalid link. No dream destinations.')
 
-    most_visited_country = admin.CountryAdmin.find_most_visited_country()
-    capital = countryinfo.CountryInfo(most_visited_country).capital()
-    country_obj= PlacesUtilities.find_places_given_place_type_and_radius(capital)
-
     context = {
         'items': countries_items,
+        # Background image of the capital of the most visited country.
+        'photo_source': f'/photo/?country={countries.find_country_code(most_visited_country)}',
     }
-    try:
-        picture = country_obj[0].get_photo_url()
-        context['photo'] = picture
-    except KeyError:
-        # There will be no background picture.
-        pass
 
     return render(request, 'destination.html', context)
 
 @login_required(login_url='/login/')
-def detailed_page(request):
+async def detailed_page(request):
     """Individual page with details for every dream destination."""
     try:
-        destination = models.Destination.objects.get(pk=request.GET['id'])
-    except (KeyError, models.Destination.DoesNotExist):
+        destination = await models.Destination.objects.aget(pk=request.GET['id'])
+    except (KeyError, ValueError, models.Destination.DoesNotExist):
         return HttpResponseNotFound('Invalid link. No ID found.')
-    try:
-        place_obj = PlacesUtilities().find_places_given_place_type_and_radius(destination)
-    except:
-        return HttpResponseNotFound(f"'{destination}' is invalid or there is lack of information about it.")
 
     context = {
         'destination_name': destination.destination_name,
+        'photo_source': f'/photo/?destination={destination.pk}',
     }
 
-    try:
-        picture = place_obj[0].get_photo_url()
-        context['photo'] = picture
-    except KeyError:
-        # There will be no background picture.
-        pass
-
+    country_facts = countries.get_country_facts(destination.country)
     detailed_info_keys = ['name', 'subregion', 'region', 'capital', 'currencies',
                            'languages','population', 'wiki']
     for item in detailed_info_keys:
-        context[item] = countryinfo.CountryInfo(destination.country).info()[item]
+        context[item] = getattr(country_facts, item)
 
     return render(request, 'details.html', context)
 
+@login_required(login_url='/login/')
+async def photo_view(request):
+    """Url of the background photo of a page. The pages load it after they are rendered,
+    so their response doesn't wait for Google. The photo is of a dream destination of
+    the user, of the capital of a country, or of Burgas by default."""
+    try:
+        if 'destination' in request.GET:
+            destination = await models.Destination.objects.aget(pk=request.GET['destination'],
+                                                                list_name__owner=await request.auser())
+            return await destination_photo_response(destination)
+        elif 'country' in request.GET:
+            query = countries.get_country_facts(request.GET['country']).capital
+        else:
+            query = 'Burgas, Bridge'
+    except (ValueError, LookupError, models.Destination.DoesNotExist):
+        return HttpResponseNotFound('Invalid link.')
+    try:
+        # The blocking Places client runs in a worker thread, so the event loop serves
+        # other requests while Google answers.
+        photo = await asyncio.to_thread(PlacesUtilities.find_photo_url, query)
+    except Exception:
+        return HttpResponseNotFound(f"'{query}' is invalid or there is lack of information about it.")
+    return photo_response(photo)
+
+async def destination_photo_response(destination):
+    """The photo is resolved when the destination is added. Google is
+    requested here only if the stored place is missing or stale."""
+    if destination.is_place_stale():
+        # Google is waited for in a thread of its own, not in the one thread shared by
+        # sync_to_async, so the concurrent refreshes don't wait for each other.
+        fields = await asyncio.to_thread(prefetch.fetch_place, destination)
+        if fields is not None:
+            await models.Destination.objects.filter(pk=destination.pk).aupdate(**fields)
+            await destination.arefresh_from_db()
+    if destination.place_fetched_at is None or not destination.place_id:
+        return HttpResponseNotFound(f"'{destination}' is invalid or there is lack of information about it.")
+    return photo_response(destination.photo_url or None)
+
+def photo_response(photo):
+    response = JsonResponse({'photo': photo})
+    patch_cache_control(response, private=True, max_age=PHOTO_MAX_AGE)
+    return response
+
 @login_required(login_url='/login/')
 def remove_item(request):
     """Remove an item from the list of dream destinations of the user."""
@@ -131,13 +169,16 @@ def add_item(request):
         list_name = models.DreamDestinationsList.objects.filter(owner=request.user).get()
     except (KeyError, ValueError, models.DreamDestinationsList.DoesNotExist):
         return HttpResponseNotFound('Invalid link.')
-    if not PlacesUtilities.is_country_valid(country):
+    # The country is stored by its canonical name, so the later lookups of its facts never miss.
+    country = countries.normalize_country_name(country)
+    if country is None:
         return HttpResponseNotFound('Please, enter a valid country in the world.')
     form = AddDestinationForm({'destination_name': destination_name,
                                 'country': country,
                                 'list_name': list_name})
     if form.is_valid():
-        form.save()
+        destination = form.save()
+        prefetch.schedule(destination.pk)
     return redirect('/dream_destinations/')
 
 @login_required(login_url='/login/')
@@ -149,15 +190,21 @@ def logout_view(request):
     logout(request)
     return redirect("/login/")
 
+@user_passes_test(lambda user: user.is_staff, login_url='/login/')
+def metrics_view(request):
+    """Percentiles of the latency, the SQL queries and the outbound calls per view. Staff only."""
+    return JsonResponse(metrics.get_summary())
+
 def register(request):
     if request.method == "POST":
         form = RegisterUserForm(request.POST)
         if form.is_valid():
-            user = form.save()
+            # The whole onboarding is one transaction, so SQLite takes the write lock only once.
+            with transaction.atomic():
+                user = form.save()
+                admin.CountriesListAdmin.populate_database(user)
+                admin.DreamDestinationsListAdmin.populate_database(user)
             login(request, user)
-            admin.CountriesListAdmin.populate_database(user)
-            admin.CountryAdmin.populate_database(user)
-            admin.DreamDestinationsListAdmin.populate_database(user)
             return redirect('/')
     else:
         form = RegisterUserForm()
@@ -170,13 +217,20 @@ def register(request):
 def visit_item_view(request):
     """Toggle between visited states of a country."""
     try:
-        item = models.Country.objects.get(pk=request.GET['id'])
         state = request.GET['state'] == '1'
+        if 'code' in request.GET:
+            # Countries from the catalogue get their row on the first touch.
+            item = admin.CountryAdmin.touch_country(request.user, request.GET['code'])
+        else:
+            item = models.Country.objects.get(pk=request.GET['id'])
         # Ensure that a user can't touch other people's stuff
         if item.countries_list.owner != request.user:
             return HttpResponseNotFound('Invalid link.')
-    except (KeyError, models.Country.DoesNotExist):
+    except (KeyError, models.Country.DoesNotExist, models.CountryList.DoesNotExist):
         return HttpResponseNotFound('Invalid link.')
-    item.visited = state
-    item.save()
-    return JsonResponse({'state': item.visited})
+    with transaction.atomic():
+        # Only a real change of the state moves the counter of the country.
+        changed = models.Country.objects.filter(pk=item.pk, visited=not state).update(visited=state)
+        if changed:
+            admin.CountryVisitsAdmin.record_visit(item.name, state)
+    return JsonResponse({'state': state})
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'traveling_the_world.settings')
 
 application = get_asgi_application()
+
+# Load the geonames data and the geolocator once per worker, before the first request.
+from gui import places
+
+places.preload()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so the latency it measures covers the other middleware as well.
+    'gui.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,6 +86,100 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Responses of Google Maps and Nominatim. Old entries are culled after MAX_ENTRIES.
+    'places': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'places',
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+
+if TESTING:
+    CACHES['places'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'places',
+    }
+
+PLACES_CACHE_ALIAS = 'places'
+
+# Time to live of the cached responses in seconds, per kind of response.
+PLACES_CACHE_TTL = {
+    'textsearch': 60 * 60 * 24,
+    # The photo urls of Google expire, so they are kept no longer than PLACES_DESTINATION_MAX_AGE.
+    'photo': 60 * 60 * 24 * 7,
+    'background': 60 * 60 * 24,
+    'geocode': 60 * 60 * 24 * 90,
+    'details': 60 * 60 * 24,
+    'ranking': 60 * 60 * 24,
+}
+
+# Generated table with the facts about the countries and their cities.
+# Build it with `python manage.py build_country_table`, otherwise it is built on first use.
+COUNTRY_TABLE_PATH = BASE_DIR / '.cache' / 'countries.sqlite3'
+
+# Base url of Google Maps - Places. It can point to the local stand-in server
+# of `python manage.py fake_places_server` for offline development.
+PLACES_API_BASE_URL = os.getenv('PLACES_API_BASE_URL', 'https://maps.googleapis.com/maps/api/place')
+
+# Outbound HTTP calls to Google Maps: timeouts in seconds, retries of 5xx and
+# OVER_QUERY_LIMIT answers with exponential backoff and the size of the connection pool.
+PLACES_HTTP_CONNECT_TIMEOUT = 3.05
+PLACES_HTTP_READ_TIMEOUT = 10
+PLACES_HTTP_RETRIES = 2
+PLACES_HTTP_BACKOFF_FACTOR = 0.5
+PLACES_HTTP_POOL_SIZE = 10
+# Threads which request the details of many places at once, within the connection pool.
+PLACES_HYDRATE_WORKERS = 8
+
+# Budgets of the outbound calls, shared by all of the workers: (tokens per second, burst).
+# Nominatim's usage policy allows 1 request per second. A call waits for a token
+# at most PLACES_RATE_LIMIT_TIMEOUT seconds and fails after that.
+PLACES_RATE_LIMITS = {
+    'nominatim': (1, 1),
+    'textsearch': (10, 20),
+    'details': (10, 20),
+    'photo': (10, 20),
+}
+PLACES_RATE_LIMIT_TIMEOUT = 10
+PLACES_RATE_LIMIT_PATH = BASE_DIR / '.cache' / 'rate_limit.sqlite3'
+
+# The attractions are ranked by the Bayesian average of their rating: as if every
+# place had PLACES_RANKING_PRIOR_WEIGHT more ratings of PLACES_RANKING_PRIOR_RATING.
+PLACES_RANKING_PRIOR_RATING = 3.5
+PLACES_RANKING_PRIOR_WEIGHT = 100
+
+# Seconds to wait before the token of the next page of a textsearch is used.
+PLACES_PAGE_TOKEN_DELAY = 2
+
+# The stand-in server of the tests has no quota and its page tokens are valid at once.
+if TESTING:
+    PLACES_RATE_LIMITS = {}
+    PLACES_PAGE_TOKEN_DELAY = 0
+
+# The added dream destinations are resolved through Places by this many background
+# threads per process. Inline, they are resolved in the request, after it commits.
+PLACES_PREFETCH_WORKERS = 2
+PLACES_PREFETCH_INLINE = TESTING
+# Seconds after which the place stored on a destination is resolved again,
+# because the photo urls of Google expire.
+PLACES_DESTINATION_MAX_AGE = 60 * 60 * 24 * 7
+
+# Number of the latest requests per view whose metrics are aggregated by /metrics/.
+METRICS_SAMPLES_PER_VIEW = 1000
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -101,6 +199,13 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Hashing the passwords dominates the run time of the tests otherwise.
+if TESTING:
+    PASSWORD_HASHERS = [
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+    ]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
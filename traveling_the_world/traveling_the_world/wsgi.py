@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'traveling_the_world.settings')
 
 application = get_wsgi_application()
+
+# Load the geonames data and the geolocator once per worker, before the first request.
+from gui import places
+
+places.preload()